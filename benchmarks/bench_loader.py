@@ -0,0 +1,174 @@
+"""
+Throughput benchmark of Loader against local fakes of deezer, youtube
+search, youtube_dl and ffmpeg. Every playlist size runs in its own process so
+peak RSS is measured separately.
+
+    python -m benchmarks.bench_loader
+    python -m benchmarks.bench_loader --tracks 100 1000 -j 8 --download-latency 0.1
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmarks.fakes import FakeServices, fake_convert, fake_youtube_dl
+from deezload import audio, base, client
+from deezload.base import LoadStatus, Loader, get_playlist
+from deezload.cache import SearchCache
+from deezload.library import Library
+from deezload.tags import CoverCache
+
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def run(args: argparse.Namespace, size: int) -> dict:
+    with FakeServices(latency=args.api_latency, page_size=args.page_size,
+                      quota=args.quota) as services, \
+            tempfile.TemporaryDirectory() as tmp:
+        client.RATE_LIMITS['127.0.0.1'] = args.rate_limit
+        base.DEEZER_API_ROOT = services.url
+        base.YOUTUBE_ROOT = services.url
+        base.YoutubeDL = fake_youtube_dl(args.download_latency, args.file_size)
+        audio.convert = fake_convert(args.convert_latency)
+        url = f'https://www.deezer.com/en/playlist/{size}'
+
+        start = time.perf_counter()
+        get_playlist(url, limit=size)
+        resolve_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loader = Loader(
+            urls=url,
+            output_dir=os.path.join(tmp, 'output'),
+            limit=size,
+            format=args.format,
+            tree=True,
+            jobs=args.jobs,
+            cache=SearchCache(os.path.join(tmp, 'search.sqlite3')) if args.cache else False,
+            library=Library(os.path.join(tmp, 'library.sqlite3')) if args.library else False,
+            covers=CoverCache(os.path.join(tmp, 'covers')),
+            lazy=args.lazy,
+        )
+        durations: Dict[str, List[float]] = defaultdict(list)
+        finished = 0
+        first_track = None
+        for status, track, i, prog in loader.load_gen():
+            if status == LoadStatus.FINISHED:
+                if first_track is None:
+                    first_track = time.perf_counter() - start
+                finished += 1
+                for stage, duration in track.timings.items():
+                    durations[stage].append(duration)
+        total_time = time.perf_counter() - start
+
+    return {
+        'tracks': size,
+        'finished': finished,
+        'jobs': args.jobs,
+        'resolve_s': resolve_time,
+        'first_track_s': first_track or 0.0,
+        'total_s': total_time,
+        'tracks_per_s': finished / total_time,
+        'stages_ms': {
+            stage: {f'p{p}': percentile(values, p) * 1000 for p in PERCENTILES}
+            for stage, values in durations.items()
+        },
+        'requests': services.requests,
+        'throttled': services.throttled,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def print_report(results: List[dict]):
+    print(f"{'tracks':>7} {'jobs':>4} {'resolve s':>9} {'first s':>7} {'total s':>8} "
+          f"{'tracks/s':>8} {'failed':>6} {'throttled':>9} {'rss MB':>7}  stage p50/p90/p99 ms")
+    for res in results:
+        stages = '  '.join(
+            f"{stage} {'/'.join(f'{v:.0f}' for v in ps.values())}"
+            for stage, ps in res['stages_ms'].items()
+        )
+        print(f"{res['tracks']:>7} {res['jobs']:>4} {res['resolve_s']:>9.2f} "
+              f"{res['first_track_s']:>7.2f} {res['total_s']:>8.2f} {res['tracks_per_s']:>8.1f} "
+              f"{res['tracks'] - res['finished']:>6} {res['throttled']:>9} "
+              f"{res['peak_rss_mb']:>7.1f}  {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help='playlist sizes (default 10 100 1000 10000)')
+    parser.add_argument('-j', dest='jobs', type=int, default=4,
+                        help='loader jobs (default 4)')
+    parser.add_argument('-f', dest='format', choices=('mp3', 'flac'), default='mp3',
+                        help='audio format (default mp3)')
+    parser.add_argument('--api-latency', type=float, default=0.005,
+                        help='latency of fake deezer/youtube responses in seconds '
+                             '(default 0.005)')
+    parser.add_argument('--page-size', type=int, default=100 * 1024,
+                        help='size of fake youtube results page in bytes (default 100KB)')
+    parser.add_argument('--download-latency', type=float, default=0.02,
+                        help='time of fake download in seconds (default 0.02)')
+    parser.add_argument('--convert-latency', type=float, default=0.02,
+                        help='time of fake conversion in seconds (default 0.02)')
+    parser.add_argument('--quota', type=int, default=0,
+                        help='requests per second served by fakes, requests over it '
+                             'are throttled (default 0, unlimited)')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='client rate limit of requests to fakes per second '
+                             '(default 0, unlimited)')
+    parser.add_argument('--file-size', type=int, default=64 * 1024,
+                        help='size of fake audio file in bytes (default 64KB)')
+    parser.add_argument('--cache', action='store_true',
+                        help='use search cache (default false)')
+    parser.add_argument('--library', action='store_true',
+                        help='use library index (default false)')
+    parser.add_argument('--lazy', action='store_true',
+                        help='resolve playlist while loading (default false)')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as json lines')
+    parser.add_argument('--single', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    if args.single:
+        print(json.dumps(run(args, args.tracks[0])))
+        return
+
+    results = []
+    for size in args.tracks:
+        # separate process for every size to measure its own peak RSS
+        cmd = [sys.executable, '-m', 'benchmarks.bench_loader', '--single',
+               *sys.argv[1:], '--tracks', str(size)]
+        out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+        results.append(json.loads(out.decode().strip().splitlines()[-1]))
+        if args.json:
+            print(json.dumps(results[-1]), flush=True)
+    if not args.json:
+        print_report(results)
+
+
+if __name__ == '__main__':
+    main()
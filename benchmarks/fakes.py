@@ -0,0 +1,228 @@
+"""
+Local stand-ins for deezer api, youtube search, youtube_dl and ffmpeg.
+
+Number of tracks in a list is encoded in its id: `/playlist/250` is a
+playlist with 250 tracks.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'tests')
+# deezer returns at most that many tracks together with playlist/album info
+EMBEDDED_TRACKS = 400
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def raw_track(i: int) -> dict:
+    return {
+        'id': i,
+        'title': f'Song {i}',
+        'duration': 180 + i % 120,
+        'artist': {'name': f'Artist {i % 50}'},
+        'album': {'title': f'Album {i % 200}'},
+    }
+
+
+def video_id(query: str) -> str:
+    return hashlib.md5(query.encode()).hexdigest()[:11]
+
+
+class FakeServices(object):
+    """
+    HTTP server which pretends to be both deezer api and youtube search.
+    """
+
+    def __init__(self, latency=0.0, page_size=100 * 1024, quota=0):
+        """
+        :param quota: max requests per second, deezer api responds with quota
+            error and youtube with 429 to requests over it, 0 disables quota
+        """
+        self.latency = latency
+        self.page_size = page_size
+        self.quota = quota
+        self.requests = 0
+        self.throttled = 0
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *_):
+                pass
+
+            def do_GET(self):
+                throttled = services.count_request()
+                if services.latency:
+                    time.sleep(services.latency)
+                url = urlparse(self.path)
+                qs = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if throttled and url.path == '/results':
+                    self.respond(b'', 'text/html', 429)
+                elif throttled:
+                    error = {'error': {'type': 'Exception', 'message': 'Quota limit exceeded',
+                                       'code': 4}}
+                    self.respond(json.dumps(error).encode(), 'application/json')
+                elif url.path == '/results':
+                    self.respond(services.search_page(qs['search_query']), 'text/html')
+                else:
+                    data = services.api(url.path.strip('/').split('/'), qs)
+                    self.respond(json.dumps(data).encode(), 'application/json')
+
+            def respond(self, body: bytes, content_type: str, status=200):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def count_request(self) -> bool:
+        """
+        Count request, return True if it's over quota of current second.
+        """
+        with self._lock:
+            self.requests += 1
+            second, count = self._window
+            now = int(time.monotonic())
+            count = count + 1 if now == second else 1
+            self._window = now, count
+            throttled = bool(self.quota) and count > self.quota
+            self.throttled += throttled
+            return throttled
+
+    def search_page(self, query: str) -> bytes:
+        """
+        Results page with video renderers right after the head of the page,
+        the first result is a live version of the song.
+        """
+        renderers = ','.join(
+            json.dumps({'videoRenderer': {
+                'videoId': video_id(query + str(i)),
+                'title': {'runs': [{'text': f"{query}{' (live)' if i == 0 else ''}"}]},
+                'lengthText': {'simpleText': '3:30'},
+            }}, separators=(',', ':'))[1:-1]
+            for i in range(20)
+        )
+        padding = '<div class="filler"></div>' * (self.page_size // 26)
+        return (f'<html><head><script>var ytInitialData = {{{renderers}}};</script></head>'
+                f'<body>{padding}</body></html>').encode()
+
+    @staticmethod
+    def tracks_page(total: int, qs: dict, default_limit=25) -> dict:
+        index = int(qs.get('index', 0))
+        limit = int(qs.get('limit', default_limit))
+        end = min(total, index + limit)
+        return {
+            'data': [raw_track(i) for i in range(index, end)],
+            'total': total,
+        }
+
+    def api(self, parts: list, qs: dict) -> dict:
+        kind, total = parts[0], int(parts[1])
+        rest = parts[2:]
+        if kind == 'user' and not rest:
+            return {'name': f'user{total}'}
+        if rest:
+            # paginated tracks: /playlist/N/tracks, /artist/N/top, /user/N/tracks
+            return self.tracks_page(total, qs)
+        if kind == 'track':
+            return raw_track(total)
+        embedded = [raw_track(i) for i in range(min(total, EMBEDDED_TRACKS))]
+        if kind == 'album':
+            return {
+                'title': f'Album {total}',
+                'artist': {'name': 'Artist'},
+                'nb_tracks': total,
+                'tracks': {'data': embedded},
+            }
+        return {
+            'title': f'Playlist {total}',
+            'nb_tracks': total,
+            'tracks': {'data': embedded},
+        }
+
+
+def fake_youtube_dl(latency=0.0, size=1024 * 1024):
+    """
+    Build YoutubeDL replacement which "downloads" raw audio stream of given
+    size after `latency` seconds.
+    """
+
+    class FakeYoutubeDL(object):
+        def __init__(self, params: dict = None):
+            self.params = params or {}
+            self.hooks = []
+
+        def add_progress_hook(self, hook):
+            self.hooks.append(hook)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_):
+            pass
+
+        def extract_info(self, url: str, download=False) -> dict:
+            return {
+                'id': parse_qs(urlparse(url).query)['v'][0],
+                'ext': 'webm',
+                'filesize': size,
+            }
+
+        def process_info(self, info: dict):
+            time.sleep(latency)
+            path = self.params['outtmpl'] % info
+            with open(path, 'wb') as f:
+                f.write(b'\0' * size)
+            for hook in self.hooks:
+                hook({'status': 'finished', 'filename': path,
+                      'total_bytes': os.path.getsize(path)})
+
+        def download(self, urls: list):
+            for url in urls:
+                self.process_info(self.extract_info(url))
+            return 0
+
+    return FakeYoutubeDL
+
+
+def fake_convert(latency=0.0):
+    """
+    Build `audio.convert` replacement which "converts" raw stream into
+    test audio file after `latency` seconds.
+    """
+
+    def convert(src: str, dst: str, format='mp3'):
+        time.sleep(latency)
+        shutil.copy(os.path.join(TESTS_DIR, f'a1.{format}'), dst)
+
+    return convert
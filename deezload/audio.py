@@ -0,0 +1,86 @@
+import errno
+import logging
+import os
+import shutil
+import subprocess
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+FFMPEG_ENCODERS = {
+    'aac': ['-c:a', 'aac'],
+    'flac': ['-c:a', 'flac'],
+    'mp3': ['-c:a', 'libmp3lame', '-q:a', '2'],
+    'm4a': ['-c:a', 'aac'],
+    'opus': ['-c:a', 'libopus'],
+    'vorbis': ['-c:a', 'libvorbis'],
+    'wav': [],
+}
+FFMPEG_MUXERS = {
+    'aac': 'adts',
+    'flac': 'flac',
+    'mp3': 'mp3',
+    'm4a': 'ipod',
+    'opus': 'opus',
+    'vorbis': 'ogg',
+    'wav': 'wav',
+}
+# codecs which are copied as is if source is already encoded with them
+COPY_CODECS = {
+    'aac': 'aac',
+    'flac': 'flac',
+    'mp3': 'mp3',
+    'm4a': 'aac',
+    'opus': 'opus',
+    'vorbis': 'vorbis',
+}
+
+
+def probe_codec(path: str) -> Optional[str]:
+    """
+    Codec of the first audio stream of the file.
+    """
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+           '-show_entries', 'stream=codec_name', '-of', 'default=nw=1:nk=1', path]
+    res = subprocess.run(cmd, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return res.stdout.decode().strip() or None
+
+
+def convert(src: str, dst: str, format='mp3'):
+    """
+    Convert local audio file into another format with ffmpeg. Audio which
+    is already encoded with required codec is only copied into new container.
+    """
+    encoder = FFMPEG_ENCODERS[format]
+    if format in COPY_CODECS and probe_codec(src) == COPY_CODECS[format]:
+        encoder = ['-c:a', 'copy']
+    logger.debug('converting %s -> %s (%s)', src, dst, ' '.join(encoder))
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', src, '-vn',
+           *encoder, '-f', FFMPEG_MUXERS[format], dst]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def link(src: str, dst: str):
+    """
+    Hard link file, copy it if file system doesn't allow that.
+    """
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def move(src: str, dst: str):
+    """
+    Atomically rename file, copy it if destination is on another file system.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
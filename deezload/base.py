@@ -1,38 +1,51 @@
-import html
+import json
 import logging
 import os
-import re
-import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing, contextmanager
 from enum import Enum, auto
-from typing import List, NamedTuple, Optional, Union
-from urllib.parse import parse_qs, urlencode
-
-import mutagen
-import requests
-from youtube_dl import YoutubeDL
-
-from deezload.settings import HOME_DIR
+from functools import partial
+from itertools import islice
+from typing import Callable, Deque, Dict, Hashable, Iterable, Iterator, List, NamedTuple, \
+    Optional, Tuple, Union
+from urllib.parse import urlencode
+
+from deezload import audio, client, tags
+from deezload.cache import SearchCache
+from deezload.library import Library
+from deezload.pipeline import Pipeline, Stage
+from deezload.scheduler import Session
+from deezload.search import ResultsParser, check_video, extract_video_id, rank
+from deezload.settings import HOME_DIR, HTTP_POOL_SIZE, TRANSCODE_WORKERS, YOUTUBE_DL_CACHE_DIR, \
+    YOUTUBE_SEARCH_CANDIDATES
+from deezload.tags import CoverCache
+from deezload.utils import normalise
 
 
 DEEZER_API_ROOT = "https://api.deezer.com"
-YOUTUBE_VIDEO_REGEX = re.compile(r'/watch\?([^\"]+)', re.I | re.M | re.U)
-NOT_ALLOWED_PATH_CHARS = set(r'<>:"/\\|?*')
+DEEZER_PAGE_SIZE = 100
+YOUTUBE_ROOT = "https://m.youtube.com"
+# "Quota limit exceeded" error of deezer api
+DEEZER_QUOTA_ERROR = 4
+# youtube results page is parsed while it's loading by chunks of that size
+SEARCH_CHUNK_SIZE = 16 * 1024
+# youtube_dl saves vorbis audio as .ogg files
+FORMAT_EXTENSIONS = {'vorbis': 'ogg'}
+# youtube streams which are only remuxed into these formats, without re-encoding
+COPY_STREAMS = {
+    'aac': 'bestaudio[acodec^=mp4a]',
+    'm4a': 'bestaudio[acodec^=mp4a]',
+    'opus': 'bestaudio[acodec=opus]',
+    'vorbis': 'bestaudio[acodec=vorbis]',
+}
 logger = logging.getLogger(__name__)
 
 
-def normalise(s: str, slugify=False):
-    """make string path-friendly"""
-    if slugify:
-        s = ''.join(c for c in s if c.isalnum() or c == ' ')
-        s = re.sub(r' +', ' ', s)
-        s = s.lower().replace(' ', '_')
-        return s
-    s = s.replace('"', '\'')
-    s = ''.join(c for c in s if c not in NOT_ALLOWED_PATH_CHARS)
-    s = re.sub(r' +', ' ', s)
-    return s
-
-
 class AppException(Exception):
     pass
 
@@ -57,13 +70,40 @@ class LoadStatus(Enum):
 
 
 class Track(object):
-    def __init__(self, artist: str, title: str, album: str):
-        self.artist = artist
+    # big libraries are resolved into hundreds of thousands of tracks
+    __slots__ = ('artist', 'title', 'album', 'deezer_id', 'track_number', 'disc_number',
+                 'year', 'isrc', 'cover_url', 'video_id', 'checked', 'path', 'source',
+                 'timings', 'file_size', 'duration', 'alternatives')
+
+    def __init__(self, artist: str, title: str, album: str,
+                 deezer_id: Optional[int] = None, track_number: Optional[int] = None,
+                 disc_number: Optional[int] = None, year: Optional[str] = None,
+                 isrc: Optional[str] = None, cover_url: Optional[str] = None,
+                 duration: Optional[int] = None):
+        # artists, albums and covers repeat across tracks, so share their strings
+        self.artist = sys.intern(artist)
         self.title = title
-        self.album = album
+        self.album = sys.intern(album)
+        # optional meta data returned by deezer
+        self.deezer_id = deezer_id
+        self.track_number = track_number
+        self.disc_number = disc_number
+        self.year = year
+        self.isrc = isrc
+        self.cover_url = cover_url and sys.intern(cover_url)
+        # seconds, helps to pick the right video
+        self.duration = duration
         self.video_id: str = None
         self.checked: bool = False
+        # next search results, they are known only after video was rejected
+        self.alternatives: Optional[List[str]] = None
         self.path: str = None
+        # local file which is converted into track's file: raw downloaded
+        # audio or already loaded file in another format
+        self.source: str = None
+        # seconds spent on every stage of loading
+        self.timings: Dict[str, float] = {}
+        self.file_size: int = 0
 
     def __str__(self):
         return f'<track {self.video_id}: {repr(self.short_name)}>'
@@ -71,11 +111,74 @@ class Track(object):
     def __repr__(self):
         return str(self)
 
-    def fetch_video_url(self):
-        self.video_id = get_video_id(self.short_name)
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = time.perf_counter() - start
+
+    def to_dict(self) -> dict:
+        return {
+            'artist': self.artist,
+            'title': self.title,
+            'album': self.album,
+            'deezer_id': self.deezer_id,
+            'track_number': self.track_number,
+            'disc_number': self.disc_number,
+            'year': self.year,
+            'isrc': self.isrc,
+            'cover_url': self.cover_url,
+            'duration': self.duration,
+        }
+
+    @classmethod
+    def from_deezer(cls, data: dict) -> 'Track':
+        release_date = data.get('release_date') or data['album'].get('release_date')
+        return cls(
+            artist=data['artist']['name'],
+            title=data['title'],
+            album=data['album']['title'],
+            deezer_id=data.get('id'),
+            track_number=data.get('track_position'),
+            disc_number=data.get('disk_number'),
+            year=release_date and release_date[:4],
+            isrc=data.get('isrc'),
+            cover_url=data['album'].get('cover_xl') or data['album'].get('cover_big'),
+            duration=data.get('duration'),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Track':
+        return cls(**data)
+
+    @property
+    def search_key(self) -> str:
+        return normalise(self.short_name, slugify=True)
+
+    def fetch_video_url(self, cache: Optional[SearchCache] = None):
+        self.video_id = cache.get(self.search_key) if cache is not None else None
+        if self.video_id is None:
+            self.video_id = get_video_id(self.short_name, self.duration)
+            if self.video_id is not None and cache is not None:
+                cache.set(self.search_key, self.video_id)
+        self.checked = True
         if self.video_id is None:
             logger.debug("Didn't find video for track %r", self.short_name)
 
+    def next_video(self) -> bool:
+        """
+        Switch to the next search result after current video was rejected.
+        Song is searched again on the first rejection, as its video might
+        have been taken from cache or restored from job.
+        """
+        if self.alternatives is None:
+            videos = search_videos(self.short_name, self.duration)
+            self.alternatives = [video_id for video_id in videos if video_id != self.video_id]
+        self.video_id = self.alternatives.pop(0) if self.alternatives else None
+        return self.video_id is not None
+
     def set_output_path(self, output_dir: str, ext='mp3', tree=False, slugify=False) -> str:
         """
         Should return absolute path to track's basedir.
@@ -93,11 +196,9 @@ class Track(object):
 
     @property
     def valid(self):
-        if self.checked:
-            return self.video_id is not None
-        self.fetch_video_url()
-        self.checked = True
-        return self.valid
+        if not self.checked:
+            self.fetch_video_url()
+        return self.video_id is not None
 
     @property
     def short_name(self) -> str:
@@ -111,25 +212,141 @@ class Track(object):
     def url(self) -> str:
         return f'http://www.youtube.com/watch?v={self.video_id}'
 
-    def restore_meta(self):
-        audio = mutagen.File(self.path, easy=True)
-        if audio is None:
-            logger.warning('failed to restore meta: %s, %s', self.path, self)
-            return
-        audio['artist'] = self.artist
-        audio['album'] = self.album
-        audio['title'] = self.title
-        audio.save()
+    def restore_meta(self, cover: Optional[bytes] = None):
+        tags.write(self.path, {
+            'artist': self.artist,
+            'album': self.album,
+            'title': self.title,
+            'tracknumber': self.track_number,
+            'discnumber': self.disc_number,
+            'date': self.year,
+            'isrc': self.isrc,
+        }, cover)
+
+
+class FailedSource(NamedTuple):
+    """Url which couldn't be resolved or read through and why."""
+    url: Optional[str]
+    error: str
+
+
+class Task(NamedTuple):
+    index: int
+    # None marks playlist which couldn't be resolved
+    track: Optional[Track]
+
+
+class Dedup(object):
+    """
+    The same track in several playlists of the load. Only the first task
+    of the track is loaded, its duplicates share the file once it's done.
+    Tracks are the same if they have the same deezer id. Normalised name is
+    only a fallback for tracks without deezer id (e.g. from job store of
+    older version), tracks with different ids are different releases.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # the first task of every track by all of its keys
+        self._first: Dict[Hashable, Task] = {}
+        # final status of the first task by its index
+        self._status: Dict[int, LoadStatus] = {}
+        # duplicates of tracks which are still loading by index of the first task
+        self._waiting: Dict[int, List[Task]] = defaultdict(list)
+        self.duplicates = 0
+
+    @staticmethod
+    def keys(track: Track) -> List[Hashable]:
+        keys = [('name', track.search_key)]
+        if track.deezer_id is not None:
+            keys.insert(0, ('deezer', track.deezer_id))
+        return keys
+
+    @staticmethod
+    def _event(first: Task, status: LoadStatus, task: Task) -> tuple:
+        track = task.track
+        track.path, track.video_id, track.checked = \
+            first.track.path, first.track.video_id, first.track.checked
+        if status == LoadStatus.FINISHED:
+            status = LoadStatus.SKIPPED
+        return status, track, task.index, 0 if status == LoadStatus.ERROR else 1
+
+    def add(self, task: Task) -> Tuple[bool, List[tuple]]:
+        """
+        Return True if task should be loaded and events of the task if it's
+        a duplicate of already loaded track.
+        """
+        keys = self.keys(task.track)
+        with self._lock:
+            first = self._first.get(keys[0])
+            if first is None and len(keys) > 1:
+                # name matches only if one of the tracks has no deezer id
+                first = self._first.get(keys[1])
+                if first is not None and first.track.deezer_id is not None:
+                    first = None
+            if first is None:
+                for key in keys:
+                    self._first.setdefault(key, task)
+                return True, []
+            self.duplicates += 1
+            status = self._status.get(first.index)
+            if status is None:
+                self._waiting[first.index].append(task)
+                return False, []
+        return False, [self._event(first, status, task)]
+
+    def done(self, index: int, track: Track, status: LoadStatus) -> List[tuple]:
+        """
+        Remember final status of the first task, return events of its
+        duplicates which were waiting for it.
+        """
+        with self._lock:
+            first = self._first.get(self.keys(track)[0])
+            if first is None or first.index != index:
+                return []
+            self._status[index] = status
+            waiting = self._waiting.pop(index, [])
+        return [self._event(first, status, task) for task in waiting]
+
+
+class PlaylistState(object):
+    """
+    Playlist which tracks are loaded by shared pipeline, its m3u file is
+    written once all of them are done.
+    """
+    __slots__ = ('playlist', 'paths', 'pending', 'fed')
+
+    def __init__(self, playlist: 'Playlist'):
+        self.playlist = playlist
+        # paths of loaded tracks by their index, m3u keeps playlist's order
+        self.paths: Dict[int, str] = {}
+        self.pending = 0
+        # all tracks of the playlist were passed to the pipeline
+        self.fed = False
+
+    @property
+    def done(self) -> bool:
+        return self.fed and self.pending == 0
 
 
 class APIUrl(NamedTuple):
     type: str
     url: str
+    # paginated list of tracks
+    tracks_url: Optional[str] = None
 
 
 class Playlist(NamedTuple):
     name: Optional[str]
-    tracks: List[Track]
+    # list or lazy iterator of tracks
+    tracks: Iterable[Track]
+    # number of tracks, known before lazy tracks are fetched
+    size: Optional[int] = None
+    url: Optional[str] = None
+
+    @property
+    def length(self) -> int:
+        return self.size if self.size is not None else len(self.tracks)
 
 
 def deezer_url(*args, qs: Optional[dict] = None) -> str:
@@ -149,24 +366,70 @@ def build_api_url(url: str, index=0, limit=50) -> Optional[APIUrl]:
         return
 
     if parts[-2] == 'album':
-        return APIUrl('album', deezer_url('album', parts[-1]))
+        return APIUrl('album', deezer_url('album', parts[-1]),
+                      deezer_url('album', parts[-1], 'tracks'))
 
     if parts[-2] == 'artist':
-        return APIUrl('artist', deezer_url('artist', parts[-1], 'top', qs=qs))
+        return APIUrl('artist', deezer_url('artist', parts[-1], 'top', qs=qs),
+                      deezer_url('artist', parts[-1], 'top'))
 
     if parts[-2] == 'playlist':
-        return APIUrl('playlist', deezer_url('playlist', parts[-1]))
+        return APIUrl('playlist', deezer_url('playlist', parts[-1]),
+                      deezer_url('playlist', parts[-1], 'tracks'))
 
     if parts[-2] == 'profile':
-        return APIUrl('profile', deezer_url('user', parts[-1], 'tracks', qs=qs))
+        return APIUrl('profile', deezer_url('user', parts[-1], 'tracks', qs=qs),
+                      deezer_url('user', parts[-1], 'tracks'))
 
     if len(parts) >= 3 and parts[-3] == 'profile':
-        return APIUrl('profile', deezer_url('user', parts[-2], 'tracks', qs=qs))
+        return APIUrl('profile', deezer_url('user', parts[-2], 'tracks', qs=qs),
+                      deezer_url('user', parts[-2], 'tracks'))
 
     if parts[-2] == 'track':
         return APIUrl('track', deezer_url('track', parts[-1]))
 
 
+def deezer_throttled(res) -> bool:
+    """
+    Deezer reports exceeded quota with ordinary response and error in body.
+    """
+    if not res.content.startswith(b'{"error"'):
+        return False
+    try:
+        return res.json()['error'].get('code') == DEEZER_QUOTA_ERROR
+    except (ValueError, AttributeError):
+        return False
+
+
+def fetch_deezer(api_url: str, url: str = None) -> dict:
+    logger.debug(api_url)
+    res = client.get(api_url, throttled=deezer_throttled)
+    logger.debug('load status %s', res.status_code)
+    data = res.json()
+    if res.status_code != 200 or 'error' in data:
+        logger.error(data)
+        raise AppException(f"Couldn't fetch data: {url or api_url}")
+    return data
+
+
+def fetch_tracks_pages(tracks_url: str, start: int, end: int,
+                       page_size=DEEZER_PAGE_SIZE) -> List[dict]:
+    """
+    Fetch raw tracks from `start` to `end` of paginated list in parallel.
+    """
+    def fetch_page(offset: int) -> List[dict]:
+        limit = min(page_size, end - offset)
+        qs = urlencode({'index': offset, 'limit': limit})
+        return fetch_deezer(f'{tracks_url}?{qs}').get('data', [])
+
+    offsets = range(start, end, page_size)
+    if not offsets:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(offsets), HTTP_POOL_SIZE)) as executor:
+        pages = list(executor.map(fetch_page, offsets))
+    return [track for page in pages for track in page]
+
+
 def get_user(url: str) -> str:
     url = url.strip('/')
     parts = url.split('/')
@@ -176,85 +439,140 @@ def get_user(url: str) -> str:
     else:
         api_url = deezer_url('user', parts[-2])
 
-    res = requests.get(api_url)
+    res = client.get(api_url, throttled=deezer_throttled)
     data = res.json()
     if 'error' in data:
         raise AppException("Couldn't fetch user")
     return data['name']
 
 
-def get_playlist(url: str, index=0, limit=50) -> Playlist:
+def get_playlist(url: str, index=0, limit=50, lazy=False) -> Playlist:
+    """
+    :param lazy: tracks are returned as iterator, which fetches the rest
+        of pages from deezer one by one while it's consumed
+    """
     logger.info('💎 Fetching tracks from %s', url)
     api_url = build_api_url(url, index, limit)
 
     if api_url is None:
         raise AppException(f"Bad url: {url}")
 
-    logger.debug(api_url)
-    res = requests.get(api_url.url)
-    logger.debug('load status %s', res.status_code)
-    data = res.json()
-    if res.status_code != 200 or 'error' in data:
-        logger.error(data)
-        raise AppException(f"Couldn't fetch data: {url}")
+    data = fetch_deezer(api_url.url, url)
+
+    # offset of first fetched track and total number of tracks in the list
+    offset = 0
+    total = None
+    if api_url.type == 'album':
+        raw_tracks = data['tracks']['data']
+        total = data.get('nb_tracks')
+
+    elif api_url.type in ('artist', 'profile'):
+        raw_tracks = data['data']
+        offset = index
+        total = data.get('total')
+
+    elif api_url.type == 'playlist':
+        raw_tracks = data['tracks']['data']
+        total = data.get('nb_tracks')
+
+    else:  # list_type == 'track'
+        raw_tracks = [data]
+        # single track is not affected by index
+        offset = index
+
+    # the rest of requested tracks is fetched page by page
+    end = index + limit if total is None else min(total, index + limit)
+    fetched = offset + len(raw_tracks)
+    rest = range(max(fetched, index), end) if api_url.tracks_url else range(0)
+    raw_tracks = raw_tracks[index - offset:end - offset]
+    size = len(raw_tracks) + len(rest)
 
     if api_url.type == 'album':
         artist = data['artist']['name']
         album_name = data['title']
-        raw_tracks = data['tracks']['data']
-        for track in raw_tracks:
-            track['album'] = {
-                'title': album_name
-            }
+        album = {
+            'title': album_name,
+            'release_date': data.get('release_date'),
+            'cover_xl': data.get('cover_xl'),
+        }
         playlist_name = f'{artist} - {album_name}'
 
     elif api_url.type == 'artist':
-        raw_tracks = data['data']
+        if not raw_tracks:
+            raise AppException(f"Couldn't fetch data: {url}")
         artist = raw_tracks[0]['artist']['name']
-        top = min(limit, len(raw_tracks))
-        playlist_name = f'{artist} - TOP {top}'
+        playlist_name = f'{artist} - TOP {size}'
 
     elif api_url.type == 'playlist':
-        raw_tracks = data['tracks']['data']
         playlist_name = data['title']
 
     elif api_url.type == 'profile':
-        raw_tracks = data['data']
         user = get_user(url)
         playlist_name = f"{user}'s favorites"
 
-    else:  # list_type == 'track'
-        raw_tracks = [data]
+    else:
         playlist_name = None
 
-    raw_tracks = raw_tracks[:limit]
-
-    tracks = []
-    for i, track in enumerate(raw_tracks):
-        track = Track(
-            artist=track['artist']['name'],
-            title=track['title'],
-            album=track['album']['title'],
-        )
+    def parse(i: int, track: dict) -> Track:
+        if api_url.type == 'album':
+            track['album'] = album
+            # album lists tracks in order
+            track.setdefault('track_position', i + 1)
+        track = Track.from_deezer(track)
         logger.debug('got track: %s', track)
-        tracks.append(track)
-    return Playlist(playlist_name, tracks)
-
-
-def extract_video_id(qs: str) -> Optional[str]:
-    qs = html.unescape(qs)
-    qs = parse_qs(qs)
-    if 'v' in qs:
-        return qs['v'][0]
+        return track
+
+    def parse_pages() -> Iterator[Track]:
+        starts = range(rest.start, rest.stop, DEEZER_PAGE_SIZE)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # next page is fetched while tracks of previous one are consumed
+            pages = (
+                executor.submit(fetch_tracks_pages, api_url.tracks_url,
+                                start, min(start + DEEZER_PAGE_SIZE, end))
+                for start in starts
+            )
+            next_page = next(pages, None)
+            yield from (parse(i, track) for i, track in enumerate(raw_tracks, start=index))
+            for start in starts:
+                page, next_page = next_page.result(), next(pages, None)
+                yield from (parse(i, track) for i, track in enumerate(page, start=start))
+
+    if lazy:
+        return Playlist(playlist_name, parse_pages(), size, url)
+    if rest:
+        raw_tracks += fetch_tracks_pages(api_url.tracks_url, rest.start, rest.stop)
+    tracks = [parse(i, track) for i, track in enumerate(raw_tracks, start=index)]
+    return Playlist(playlist_name, tracks, url=url)
+
+
+def search_videos(song_name: str, duration: Optional[int] = None) -> List[str]:
+    """
+    Find videos of the song, the best first. Results page is parsed while
+    it's loading and only first candidates are ranked by their titles and
+    durations.
+    """
+    res = client.get(f'{YOUTUBE_ROOT}/results?search_query={song_name}', stream=True)
+    with closing(res):
+        if res.status_code != 200:
+            # throttled search isn't the same as not found video
+            raise AppException(f"Couldn't search for {song_name}: status {res.status_code}")
+        parser = ResultsParser(YOUTUBE_SEARCH_CANDIDATES)
+        for chunk in res.iter_content(SEARCH_CHUNK_SIZE):
+            parser.feed(chunk)
+            if parser.done:
+                break
+        else:
+            parser.feed(b'', final=True)
+    results = rank(parser.candidates(), song_name, duration)
+    if results:
+        logger.debug('found video %s: %r', results[0].video_id, results[0].title)
+    return [result.video_id for result in results]
 
 
-def get_video_id(song_name) -> Optional[str]:
-    search_res = requests.get(f'https://m.youtube.com/results?search_query={song_name}')
-    search_res = search_res.content.decode('utf-8')
-    videos = YOUTUBE_VIDEO_REGEX.findall(search_res)
+def get_video_id(song_name: str, duration: Optional[int] = None) -> Optional[str]:
+    videos = search_videos(song_name, duration)
     if videos:
-        video_id = extract_video_id(videos[0])
-        return video_id
+        return videos[0]
 
 
 def get_song_name(track: dict):
@@ -264,7 +582,13 @@ def get_song_name(track: dict):
     return full_name
 
 
-def get_ytdl_options(dir_path: str, format='mp3'):
+def get_ytdl_options(dir_path: str, format='mp3', transcode=True, extract_audio=True):
+    """
+    :param transcode: if False streams already encoded with requested codec
+        are preferred, so ffmpeg only copies audio into new container
+    :param extract_audio: convert loaded stream into `format`, otherwise
+        raw stream is saved as is
+    """
     if format not in ('aac', 'flac', 'mp3', 'm4a', 'opus', 'vorbis', 'wav'):
         logger.warning("Bad format. Fallback to mp3")
         format = 'mp3'
@@ -274,15 +598,140 @@ def get_ytdl_options(dir_path: str, format='mp3'):
         'nopostoverwrites': False,
     }]
     options = {
-        'postprocessors': postprocessors,
+        'postprocessors': postprocessors if extract_audio else [],
         'outtmpl': os.path.join(dir_path, '%(id)s.%(ext)s'),
+        # audio-only streams are cheaper to convert than videos
         'format': 'bestaudio/best',
         'ignoreerrors': True,
+        'cachedir': YOUTUBE_DL_CACHE_DIR,
         'logger': logging.getLogger('youtube_dl'),
     }
+    if not transcode and format in COPY_STREAMS:
+        options['format'] = f"{COPY_STREAMS[format]}/{options['format']}"
     return options
 
 
+def YoutubeDL(options: dict):
+    """
+    youtube_dl takes most of the startup time, so it's imported only when
+    the first instance is created, not by commands which don't load tracks.
+    """
+    from youtube_dl import YoutubeDL as _YoutubeDL
+    return _YoutubeDL(options)
+
+
+@contextmanager
+def no_slot():
+    # contextlib.nullcontext is python 3.7+
+    yield
+
+
+class ProgressHook(object):
+    """
+    youtube_dl progress hook, remembers loaded file and its size.
+    """
+
+    def __init__(self):
+        self.filename: Optional[str] = None
+        self.bytes = 0
+
+    def reset(self):
+        self.filename = None
+        self.bytes = 0
+
+    def __call__(self, info: dict):
+        if info['status'] == 'finished':
+            self.filename = info.get('filename')
+            self.bytes = info.get('total_bytes') or info.get('downloaded_bytes') or 0
+
+
+class YoutubeDLPool(object):
+    """
+    Long-lived youtube_dl instances leased to loaders one at a time.
+    Instances are keyed by their options except of output template, which
+    is set on every lease, so initialized extractors, their caches and
+    cookies survive between loads into different directories.
+    """
+
+    def __init__(self, max_idle=4):
+        # max number of idle instances kept for every set of options
+        self.max_idle = max_idle
+        self._idle: Dict[str, List[Tuple[YoutubeDL, ProgressHook]]] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _key(options: dict) -> str:
+        return json.dumps({k: v for k, v in options.items() if k not in ('outtmpl', 'logger')},
+                          sort_keys=True, default=str)
+
+    @staticmethod
+    def _create(options: dict) -> Tuple[YoutubeDL, ProgressHook]:
+        ydl = YoutubeDL(options)
+        hook = ProgressHook()
+        ydl.add_progress_hook(hook)
+        return ydl, hook
+
+    @staticmethod
+    def _close(ydl: YoutubeDL):
+        try:
+            ydl.__exit__(None, None, None)
+        except Exception as e:
+            logger.debug("couldn't close youtube_dl: %s", e)
+
+    def warm(self, options: dict, size: int):
+        """
+        Create up to `size` idle instances with initialized youtube extractor.
+        """
+        key = self._key(options)
+        with self._lock:
+            missing = size - len(self._idle.get(key, []))
+        instances = []
+        for _ in range(max(0, missing)):
+            ydl, hook = self._create(options)
+            try:
+                ydl.get_info_extractor('Youtube').initialize()
+            except Exception as e:
+                logger.debug("couldn't initialize youtube extractor: %s", e)
+            instances.append((ydl, hook))
+        with self._lock:
+            self._idle.setdefault(key, []).extend(instances)
+
+    @contextmanager
+    def lease(self, options: dict) -> Iterator[Tuple[YoutubeDL, ProgressHook]]:
+        key = self._key(options)
+        with self._lock:
+            idle = self._idle.get(key)
+            instance = idle.pop() if idle else None
+        if instance is None:
+            instance = self._create(options)
+        ydl, hook = instance
+        ydl.params['outtmpl'] = options['outtmpl']
+        hook.reset()
+        try:
+            yield instance
+        finally:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(instance)
+                    instance = None
+            if instance is not None:
+                self._close(ydl)
+
+    def close(self):
+        with self._lock:
+            instances = [i for idle in self._idle.values() for i in idle]
+            self._idle.clear()
+        for ydl, _ in instances:
+            self._close(ydl)
+
+
 class PlaylistWriter(object):
     def __init__(self, output_dir: str, name: Optional[str]):
         self.file = None
@@ -310,78 +759,475 @@ class PlaylistWriter(object):
 
 
 class Loader(object):
-    def __init__(self, urls: Union[str, List[str]], output_dir=None,
+    def __init__(self, urls: Union[str, Iterable[str]], output_dir=None,
                  index=0, limit=50, format='mp3', tree=False,
-                 playlist_name=None, slugify=True):
+                 playlist_name=None, slugify=True, jobs=1,
+                 cache: Union[bool, SearchCache] = True,
+                 library: Union[bool, Library] = True,
+                 playlists: Optional[List[Playlist]] = None,
+                 ydl_pool: Optional[YoutubeDLPool] = None,
+                 transcode=True,
+                 covers: Union[bool, CoverCache] = True,
+                 lazy=False):
+        """
+        :param transcode: if False youtube streams which don't need re-encoding
+            into `format` are preferred
+        :param playlists: already resolved playlists, `urls` are not resolved
+            if they are passed
+        :param lazy: resolve urls while loading instead of doing it up front:
+            next pages of playlist are fetched while tracks from previous are
+            loading and size of loader is refined as they arrive, such loader
+            can be loaded once; its urls can be a stream, such urls are checked
+            while they are read
+        :param ydl_pool: shared youtube_dl instances, by default loader
+            creates its own for every `load_gen` call
+        """
         if isinstance(urls, str):
             urls = [urls]
+        elif not lazy or playlists is not None:
+            urls = list(urls)
         self.format = format
+        self.ext = FORMAT_EXTENSIONS.get(format, format)
+        self.transcode = transcode
         self.tree = tree
         self.slugify = slugify
-
-        self.playlists = [
-            get_playlist(url, index, limit)
-            for url in urls
-        ]
-        if len(self.playlists) == 1:
-            pl = self.playlists[0]
-            self.playlists[0] = Playlist(
-                name=playlist_name or pl.name,
-                tracks=pl.tracks,
-            )
-        self.size = sum(map(len, (p.tracks for p in self.playlists)))
+        self.jobs = max(1, jobs or 1)
+        if cache is True:
+            cache = SearchCache()
+        self.cache: Optional[SearchCache] = cache if cache is not False else None
+        if library is True:
+            library = Library()
+        self.library: Optional[Library] = library if library is not False else None
+        self.ydl_pool = ydl_pool
+        if covers is True:
+            covers = CoverCache()
+        self.covers: Optional[CoverCache] = covers if covers is not False else None
+
+        streamed = not isinstance(urls, list)
+        if playlists is None and lazy and not streamed:
+            for url in urls:
+                if build_api_url(url) is None:
+                    raise AppException(f"Bad url: {url}")
+        elif playlists is None and not lazy:
+            playlists = self.resolve(urls, index, limit)
+        self.index = index
+        self.limit = limit
+        # urls which are resolved while loading
+        self.urls = urls if playlists is None else []
+        single = not streamed and len(urls if playlists is None else playlists) == 1
+        self.playlist_name = playlist_name if single else None
+        # provisional while lazy playlists are resolved
+        self.size = 0
+        self._size_lock = threading.Lock()
+        self.playlists: List[Playlist] = []
+        for playlist in playlists or []:
+            self.add_playlist(playlist)
+        # called with index and playlist before it's loaded, may wrap its tracks
+        self.on_playlist: Optional[Callable[[int, Playlist], Playlist]] = None
+        # share of server's workers budgets, loader isn't limited without it
+        self.session: Optional[Session] = None
+        # playlists of tracks which are loading by their index
+        self._loading: Dict[int, PlaylistState] = {}
+        self.duplicates = 0
+        # source of the last error event of the load
+        self.failed: Optional[FailedSource] = None
 
         output_dir = output_dir or HOME_DIR
         self.output_dir = os.path.abspath(output_dir)
         os.makedirs(self.output_dir, exist_ok=True)
         logger.debug('output dir: %s', self.output_dir)
+        # raw audio is converted in separate stage
+        self.ydl_options = get_ytdl_options(self.output_dir, format=self.format,
+                                            transcode=self.transcode, extract_audio=False)
 
     def __len__(self):
         return self.size
 
-    def load_tracks(self, ydl: YoutubeDL, tracks: List[Track]):
-        for i, track in enumerate(tracks):
-            yield LoadStatus.STARTING, track, i, 0
-            # check if file already loaded
-            track_dir = track.set_output_path(self.output_dir, self.format,
-                                              self.tree, self.slugify)
-            os.makedirs(track_dir, exist_ok=True)
-            if os.path.exists(track.path):
-                yield LoadStatus.SKIPPED, track, i, 1
+    @staticmethod
+    def resolve(urls: List[str], index=0, limit=50) -> List[Playlist]:
+        if len(urls) < 2:
+            return [get_playlist(url, index, limit) for url in urls]
+        with ThreadPoolExecutor(max_workers=min(len(urls), HTTP_POOL_SIZE)) as executor:
+            return list(executor.map(lambda url: get_playlist(url, index, limit), urls))
+
+    def add_playlist(self, playlist: Playlist, counted=False) -> Playlist:
+        """
+        :param counted: size of playlist was already added to loader's size
+        """
+        if self.playlist_name:
+            playlist = playlist._replace(name=self.playlist_name)
+        self.playlists.append(playlist)
+        if not counted:
+            self._grow(playlist.length)
+        return playlist
+
+    def _grow(self, count: int):
+        # size is refined from feeder and from threads resolving playlists
+        with self._size_lock:
+            self.size += count
+
+    def iter_playlists(self) -> Iterator[Union[Playlist, FailedSource]]:
+        """
+        Yield playlists in order of urls. Lazy loader fetches first pages of
+        next urls in parallel and yields every playlist as soon as its first
+        page is ready. Only a few urls are read ahead, so urls can be streamed
+        from a long list. `FailedSource` is yielded for url which couldn't be
+        resolved.
+        """
+        if not self.urls:
+            yield from self.playlists
+            return
+        urls, self.urls = iter(self.urls), []
+        with ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE) as executor:
+            def submit(url: str):
+                future = executor.submit(get_playlist, url, self.index, self.limit, lazy=True)
+                # overall progress doesn't drop back when feeder reaches playlist
+                future.add_done_callback(count_playlist)
+                futures.append((url, future))
+
+            def count_playlist(future: Future):
+                if not future.cancelled() and future.exception() is None:
+                    self._grow(future.result().length)
+
+            futures = deque()
+            for url in islice(urls, HTTP_POOL_SIZE):
+                submit(url)
+            while futures:
+                url, future = futures.popleft()
+                for next_url in islice(urls, 1):
+                    submit(next_url)
+                try:
+                    playlist = future.result()
+                except Exception as e:
+                    logger.error("couldn't resolve %s: %s", url, e)
+                    yield FailedSource(url, str(e))
+                else:
+                    yield self.add_playlist(playlist, counted=True)
+
+    def count_tracks(self, playlist: Playlist) -> Iterator[Track]:
+        """Refine provisional size of loader with actual number of tracks."""
+        expected = playlist.length
+        count = 0
+        for count, track in enumerate(playlist.tracks, start=1):
+            if count > expected:
+                self._grow(1)
+            yield track
+        if count < expected:
+            self._grow(count - expected)
+
+    def slot(self, budget: str):
+        if self.session is None:
+            return no_slot()
+        return self.session.slot(budget)
+
+    @property
+    def cache_hits(self) -> int:
+        return self.cache.hits if self.cache is not None else 0
+
+    @property
+    def cache_misses(self) -> int:
+        return self.cache.misses if self.cache is not None else 0
+
+    def check_library(self, track: Track) -> bool:
+        """
+        Return True if track's file is in place: it was already loaded or
+        the same file was found in library and linked. If library has the
+        track in another format it's remembered as track's source.
+        """
+        if self.library is None:
+            return os.path.exists(track.path)
+
+        meta = track.artist, track.album, track.title
+        entries = self.library.find(*meta, video_id=track.video_id)
+        for entry in entries:
+            if entry.path != track.path:
+                continue
+            # index may be stale, file could be deleted since it was added
+            if os.path.exists(entry.path):
+                return True
+            self.library.remove(entry.path)
+        entries = [entry for entry in entries if entry.path != track.path]
+        if os.path.exists(track.path):
+            self.library.add(track.path, *meta, video_id=track.video_id)
+            return True
+
+        for entry in entries:
+            if entry.format != self.ext:
                 continue
-            # check if video exists
-            yield LoadStatus.SEARCHING, track, i, 0.1
-            track.fetch_video_url()
-            if not track.valid:
-                yield LoadStatus.FAILED, track, i, 1
+            try:
+                audio.link(entry.path, track.path)
+            except FileNotFoundError:
+                self.library.remove(entry.path)
                 continue
-            # load
-            yield LoadStatus.LOADING, track, i, 0.2
-            ydl.download([track.url])
+            logger.debug('linked %s -> %s', entry.path, track.path)
+            self.library.add(track.path, *meta, video_id=entry.video_id)
+            return True
+
+        for entry in entries:
+            if os.path.exists(entry.path):
+                track.source = entry.path
+                break
+        return False
+
+    def playlist_of(self, index: int) -> Optional['Playlist']:
+        """
+        Playlist of track which is loading, its final event is the last one
+        when it's known.
+        """
+        state = self._loading.get(index)
+        if state is not None:
+            return state.playlist
+
+    def dedup_task(self, dedup: Dedup, task: Task, emit: Callable) -> bool:
+        if task.track is None:
+            emit(LoadStatus.ERROR, None, task.index, 0)
+            return False
+        passed, events = dedup.add(task)
+        for event in events:
+            emit(*event)
+        return passed
+
+    def search_task(self, task: Task, emit: Callable) -> bool:
+        track, i = task.track, task.index
+        emit(LoadStatus.STARTING, track, i, 0)
+        # check if file already loaded
+        track_dir = track.set_output_path(self.output_dir, self.ext,
+                                          self.tree, self.slugify)
+        os.makedirs(track_dir, exist_ok=True)
+        with track.timer('lookup'):
+            loaded = self.check_library(track)
+        if loaded:
+            emit(LoadStatus.SKIPPED, track, i, 1)
+            return False
+        if track.source:
+            return True
+        # check if video exists, resumed jobs already know it
+        if not track.checked:
+            emit(LoadStatus.SEARCHING, track, i, 0.1)
+            with track.timer('search'):
+                track.fetch_video_url(self.cache)
+        if not track.valid:
+            emit(LoadStatus.FAILED, track, i, 1)
+            return False
+        return True
+
+    def download_task(self, ydl_pool: YoutubeDLPool, staging_dir: str,
+                      task: Task, emit: Callable) -> bool:
+        """
+        Load raw audio into job's staging directory. Every track has its own
+        file there, so concurrent loads of the same video don't collide.
+        """
+        track, i = task.track, task.index
+        emit(LoadStatus.LOADING, track, i, 0.2)
+        if track.source:
+            return True
+        # probe and download take one slot of server's download budget
+        with self.slot('download'):
+            video_id = track.video_id
+            with track.timer('probe'):
+                info = self.probe_video(ydl_pool, track)
+            if info is None:
+                emit(LoadStatus.FAILED, track, i, 1)
+                return False
+            if track.video_id != video_id and self.cache is not None:
+                self.cache.set(track.search_key, track.video_id)
+            # staging dir is in output dir, so renaming doesn't copy file
+            name = f'{i}-{track.video_id}'
+            options = dict(self.ydl_options, outtmpl=os.path.join(staging_dir, f'{name}.%(ext)s'))
+            try:
+                # youtube_dl instances are not thread-safe, so every download
+                # worker borrows its own
+                with ydl_pool.lease(options) as (ydl, hook), track.timer('download'):
+                    # video was already extracted by probe
+                    ydl.process_info(info)
+                    track.source, track.file_size = hook.filename, hook.bytes
+                if track.source is None:
+                    raise AppException(f"Failed to load {track.url}")
+            except Exception:
+                self.remove_staged(staging_dir, name)
+                raise
+        return True
+
+    def probe_video(self, ydl_pool: YoutubeDLPool, track: Track) -> Optional[dict]:
+        """
+        Extract info of track's video without downloading it. Videos which
+        don't fit the track are rejected and the next search results are
+        tried. Return info of accepted video, None if there is none.
+        """
+        with ydl_pool.lease(self.ydl_options) as (ydl, _):
+            while track.video_id is not None:
+                info = ydl.extract_info(track.url, download=False)
+                reason = check_video(info, track.duration)
+                if reason is None:
+                    return info
+                logger.info('rejected video %s of %r: %s',
+                            track.video_id, track.short_name, reason)
+                track.next_video()
+
+    def convert_task(self, staging_dir: str, task: Task, emit: Callable) -> bool:
+        """
+        Convert raw or library audio into track's format and rename it into
+        track's path, so partial files never appear in the tree.
+        """
+        track, i = task.track, task.index
+        name = f'{i}-{track.video_id}'
+        # raw file can have the same extension
+        src_path = os.path.join(staging_dir, f'{name}.out.{self.ext}')
+        try:
+            with self.slot('transcode'), track.timer('convert'):
+                audio.convert(track.source, src_path, self.format)
             # moving file
-            yield LoadStatus.MOVING, track, i, 0.8
-            src_path = os.path.join(self.output_dir, f'{track.video_id}.{self.format}')
-            shutil.move(src_path, track.path)
-            # restore meta data
-            yield LoadStatus.RESTORING_META, track, i, 0.9
-            track.restore_meta()
-            # fin
-            yield LoadStatus.FINISHED, track, i, 1
+            emit(LoadStatus.MOVING, track, i, 0.8)
+            with track.timer('move'):
+                audio.move(src_path, track.path)
+        finally:
+            if os.path.dirname(track.source) == staging_dir:
+                track.source = None
+            self.remove_staged(staging_dir, name)
+        track.file_size = track.file_size or os.path.getsize(track.path)
+        return True
+
+    @staticmethod
+    def remove_staged(staging_dir: str, name: str):
+        """
+        Remove raw, partial and intermediate files of the track.
+        """
+        for entry in os.scandir(staging_dir):
+            if entry.name.startswith(f'{name}.'):
+                os.remove(entry.path)
+
+    def tag_task(self, task: Task, emit: Callable) -> bool:
+        track, i = task.track, task.index
+        # restore meta data
+        emit(LoadStatus.RESTORING_META, track, i, 0.9)
+        with track.timer('tag'):
+            cover = self.covers.get(track.cover_url) if self.covers is not None else None
+            track.restore_meta(cover)
+            if self.library is not None:
+                self.library.add(track.path, track.artist, track.album, track.title,
+                                 video_id=track.video_id)
+        # fin
+        emit(LoadStatus.FINISHED, track, i, 1)
+        return True
+
+    def load_tracks(self, ydl_pool: YoutubeDLPool, staging_dir: str, tasks: Iterable[Task],
+                    dedup: Dedup):
+        """
+        Run tasks through dedup -> search -> download -> convert -> tag
+        worker pools. Every pool has `jobs` workers, so up to `jobs` tracks
+        are processed by each stage simultaneously. Conversion is CPU bound,
+        so it has worker per core instead. Queues between stages are
+        bounded, so raw files don't pile up if conversion is slower than
+        loading.
+        """
+        def on_error(task: Optional[Task], _: Exception):
+            if task is None:
+                pipeline.emit(LoadStatus.ERROR, None, 0, 0)
+            else:
+                pipeline.emit(LoadStatus.ERROR, task.track, task.index, 0)
+
+        pipeline = Pipeline([
+            Stage('dedup', partial(self.dedup_task, dedup), 1),
+            Stage('search', self.search_task, self.jobs),
+            Stage('download', partial(self.download_task, ydl_pool, staging_dir), self.jobs),
+            Stage('convert', partial(self.convert_task, staging_dir), TRANSCODE_WORKERS),
+            Stage('tag', self.tag_task, self.jobs),
+        ], maxsize=self.jobs * 2, on_error=on_error)
+        for event in pipeline.run(tasks):
+            yield event
+            status, track, i, _ = event
+            if track is not None and status in (*LoadStatus.finite_states(), LoadStatus.ERROR):
+                yield from dedup.done(i, track, status)
+
+    def write_playlist(self, state: PlaylistState):
+        with PlaylistWriter(self.output_dir, state.playlist.name) as pw:
+            for i in sorted(state.paths):
+                pw.write(state.paths[i])
 
     def load_gen(self):
-        options = get_ytdl_options(self.output_dir, format=self.format)
-        with YoutubeDL(options) as ydl:
-            last_index = 0
-            for playlist in self.playlists:
-                pw = PlaylistWriter(self.output_dir, playlist.name)
+        """
+        Load tracks of all playlists with one shared pipeline, so workers
+        don't wait for the last tracks of one playlist before the next one
+        starts. Index of track is global for the whole load. The same
+        tracks of different playlists are loaded once.
+        """
+        ydl_pool = self.ydl_pool or YoutubeDLPool(max_idle=self.jobs)
+        staging = tempfile.TemporaryDirectory(prefix='.deezload-', dir=self.output_dir)
+        dedup = Dedup()
+        lock = threading.Lock()
+        # playlists which m3u files are not written yet
+        states: List[PlaylistState] = []
+        # sources which failed in order of their error events
+        failed: Deque[FailedSource] = deque()
+
+        def finish(state: PlaylistState) -> bool:
+            # true only once, when the last track of the whole playlist is done
+            with lock:
+                if state.done and state in states:
+                    states.remove(state)
+                    return True
+            return False
+
+        def tasks() -> Iterator[Task]:
+            index = 0
+            for p, playlist in enumerate(self.iter_playlists()):
+                if isinstance(playlist, FailedSource):
+                    failed.append(playlist)
+                    yield Task(index, None)
+                    continue
+                if self.on_playlist is not None:
+                    playlist = self.on_playlist(p, playlist)
+                state = PlaylistState(playlist)
+                with lock:
+                    states.append(state)
                 try:
-                    for status, track, i, prog in self.load_tracks(ydl, playlist.tracks):
-                        if status in (LoadStatus.FINISHED, LoadStatus.SKIPPED):
-                            pw.write(track.path)
-
-                        yield status, track, last_index + i, prog
-                    last_index = len(playlist.tracks)
+                    for track in self.count_tracks(playlist):
+                        with lock:
+                            state.pending += 1
+                        self._loading[index] = state
+                        yield Task(index, track)
+                        index += 1
                 except Exception as e:
+                    # the rest of playlists is loaded anyway
                     logger.exception(e)
-                    yield LoadStatus.ERROR, None, 0, 0
-                pw.close()
+                    failed.append(FailedSource(playlist.url, str(e)))
+                    yield Task(index, None)
+                with lock:
+                    state.fed = True
+                if finish(state):
+                    self.write_playlist(state)
+
+        events = self.load_tracks(ydl_pool, staging.name, tasks(), dedup)
+        try:
+            for status, track, i, prog in events:
+                final = track is not None and status in (*LoadStatus.finite_states(),
+                                                         LoadStatus.ERROR)
+                state = self._loading.get(i) if final else None
+                if state is not None and status in (LoadStatus.FINISHED, LoadStatus.SKIPPED):
+                    state.paths[i] = track.path
+                self.duplicates = dedup.duplicates
+                if status == LoadStatus.ERROR and track is None:
+                    self.failed = failed.popleft() if failed else None
+
+                yield status, track, i, prog
+
+                if state is None:
+                    continue
+                del self._loading[i]
+                with lock:
+                    state.pending -= 1
+                if finish(state):
+                    self.write_playlist(state)
+        except Exception as e:
+            logger.exception(e)
+            self.failed = FailedSource(None, str(e))
+            yield LoadStatus.ERROR, None, 0, 0
+        finally:
+            events.close()
+            # loading was stopped, playlists get tracks which are already loaded
+            for state in states:
+                self.write_playlist(state)
+            self._loading.clear()
+            staging.cleanup()
+            if ydl_pool is not self.ydl_pool:
+                ydl_pool.close()
@@ -0,0 +1,81 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from deezload.settings import CACHE_DIR, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCache(object):
+    """
+    Persistent mapping of normalised song names to youtube video ids.
+    Entries older than `ttl` seconds are ignored, when cache grows over
+    `max_size` entries least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str = None, ttl=SEARCH_CACHE_TTL, max_size=SEARCH_CACHE_SIZE):
+        self.path = path or os.path.join(CACHE_DIR, 'search.sqlite3')
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS search ('
+            'key TEXT PRIMARY KEY, video_id TEXT NOT NULL, '
+            'created REAL NOT NULL, used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS search_used ON search (used)')
+        self.prune()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM search').fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT video_id FROM search WHERE key = ? AND created > ?',
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return
+            self.hits += 1
+            self._conn.execute('UPDATE search SET used = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def set(self, key: str, video_id: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO search (key, video_id, created, used) '
+                'VALUES (?, ?, ?, ?)',
+                (key, video_id, now, now)
+            )
+
+    def prune(self):
+        """Remove expired entries and evict least recently used ones."""
+        with self._lock:
+            self._conn.execute('DELETE FROM search WHERE created <= ?',
+                               (time.time() - self.ttl,))
+            self._conn.execute(
+                'DELETE FROM search WHERE key IN ('
+                'SELECT key FROM search ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self.max_size,)
+            )
+
+    def close(self):
+        self.prune()
+        with self._lock:
+            self._conn.close()
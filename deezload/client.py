@@ -0,0 +1,142 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from deezload.settings import DEEZER_RATE_LIMIT, HTTP_BACKOFF, HTTP_BACKOFF_MAX, HTTP_POOL_SIZE, \
+    HTTP_RETRIES, HTTP_TIMEOUT, YOUTUBE_RATE_LIMIT
+
+
+logger = logging.getLogger(__name__)
+# requests per second by host, other hosts aren't rate limited
+RATE_LIMITS = {
+    'api.deezer.com': DEEZER_RATE_LIMIT,
+    'm.youtube.com': YOUTUBE_RATE_LIMIT,
+    'www.youtube.com': YOUTUBE_RATE_LIMIT,
+}
+
+_session: requests.Session = None
+_limiters: Dict[str, 'HostLimiter'] = {}
+_lock = threading.Lock()
+
+
+class HostLimiter(object):
+    """
+    Requests to one host. Token bucket caps their rate, number of requests
+    in flight is halved every time host throttles and grows back by one
+    after every `window` successful requests.
+    """
+
+    def __init__(self, rate=0.0, burst: float = None, concurrency=HTTP_POOL_SIZE, window=10):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.max_concurrency = concurrency
+        self.concurrency = concurrency
+        self.window = window
+        self.active = 0
+        self.successes = 0
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.concurrency:
+                self._cond.wait()
+            self.active += 1
+            while self.rate:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                self._cond.wait((1 - self.tokens) / self.rate)
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.active -= 1
+            if throttled:
+                self.successes = 0
+                if self.concurrency > 1:
+                    self.concurrency //= 2
+                    logger.debug('concurrency decreased to %d', self.concurrency)
+            else:
+                self.successes += 1
+                if self.successes >= self.window and self.concurrency < self.max_concurrency:
+                    self.successes = 0
+                    self.concurrency += 1
+            self._cond.notify_all()
+
+
+def get_session() -> requests.Session:
+    """
+    Shared session, keeps connections to deezer and youtube alive between
+    requests and threads.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                  pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def get_limiter(host: str) -> HostLimiter:
+    with _lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter(RATE_LIMITS.get(host, 0.0))
+        return _limiters[host]
+
+
+def backoff(attempt: int, res: Optional[requests.Response] = None) -> float:
+    """
+    Delay before retry: server's Retry-After or exponential backoff with
+    full jitter, so throttled workers don't retry all at once.
+    """
+    retry_after = res.headers.get('Retry-After', '') if res is not None else ''
+    if retry_after.isdigit():
+        return min(float(retry_after), HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF * 2 ** attempt))
+
+
+def get(url: str, throttled: Callable[[requests.Response], bool] = None,
+        retries=HTTP_RETRIES, **kwargs) -> requests.Response:
+    """
+    Rate limited GET. Throttled responses (429, 5xx or if `throttled(res)`
+    is true) and connection errors are retried with backoff, response of
+    the last attempt is returned.
+    """
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    limiter = get_limiter(urlparse(url).hostname)
+    for attempt in range(retries + 1):
+        res, error, retry = None, None, False
+        limiter.acquire()
+        try:
+            res = get_session().get(url, **kwargs)
+            retry = res.status_code == 429 or res.status_code >= 500 or \
+                bool(throttled and throttled(res))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error, retry = e, True
+        finally:
+            limiter.release(throttled=retry)
+        if not retry or attempt == retries:
+            break
+        if res is not None:
+            # streamed response would hold its connection
+            res.close()
+        delay = backoff(attempt, res)
+        logger.warning('%s, retry in %.1fs: %s', error or f'status {res.status_code}', delay, url)
+        time.sleep(delay)
+    if error is not None:
+        raise error
+    return res
@@ -1,16 +1,23 @@
 #!/usr/bin/env python
 
 import argparse
+import json
 import logging
+import os
 import signal
+import sys
+from datetime import datetime
+from typing import TYPE_CHECKING, Iterator, Optional
 
-from deezload.base import LoadStatus, Loader
-from deezload.build import build_app
-from deezload.gui import start_app
-from deezload.server import start_server
-from deezload.settings import DEBUG, UI_TYPE
+from deezload.settings import DEBUG, HOME_DIR, UI_TYPE
 from deezload.utils import setup_logging
 
+# every mode imports only what it needs (tkinter, sanic, youtube_dl, etc)
+# inside of its function, so short commands start fast
+if TYPE_CHECKING:
+    from deezload.base import Loader
+    from deezload.jobs import JobStore
+
 
 logger = logging.getLogger(__name__)
 
@@ -29,38 +36,110 @@ class GracefulKiller:
         self.should_stop = True
 
 
-def load(loader):
-    killer = GracefulKiller()
+def load(loader: 'Loader', events=None, killer: GracefulKiller = None,
+         job_id: Optional[int] = None, output: Optional[str] = None):
+    """
+    :param events: raw events of the load, `loader.load_gen()` by default
+    :param output: print `events` or final `results` of tracks and failed
+        sources as json lines into stdout
+    """
+    from deezload.base import LoadStatus
+    from deezload.events import load_events
+    from deezload.metrics import Metrics
 
-    for status, track, i, prog in loader.load_gen():
-        if status == LoadStatus.STARTING:
-            logger.info("✅  loading: %s", track.short_name)
-        elif status == LoadStatus.SEARCHING:
-            logger.info("\tsearching for video...")
-        elif status == LoadStatus.LOADING:
-            logger.info("\tloading audio...")
-        elif status == LoadStatus.MOVING:
-            logger.info("\tmoving file...")
-        elif status == LoadStatus.RESTORING_META:
-            logger.info("\trestoring file meta data...")
+    killer = killer or GracefulKiller()
 
+    metrics = Metrics()
+    loaded, skipped, failed = 0, 0, 0
+    for event in load_events(loader, events, job_id):
+        status = event.status
+        metrics.observe(status, event.track)
+        # results of tracks and of sources which failed
+        result = event.final and (event.track is not None or event.error is not None)
+        if output == 'events' or output == 'results' and result:
+            print(json.dumps(event.to_dict(), ensure_ascii=False), flush=True)
+
+        if status == LoadStatus.STARTING:
+            # total is provisional while playlists are resolved
+            logger.info("✅  [%d/%d] %s", event.index + 1, event.total, event.message)
         elif status == LoadStatus.FAILED:
-            logger.info("\t⚠️ wasn't able to find track")
+            failed += 1
+            logger.info("\t⚠️ %s", event.message)
         elif status == LoadStatus.SKIPPED:
-            logger.info("\ttrack already exists at %s", track.path)
+            skipped += 1
+            logger.info("\t%s", event.message)
         elif status == LoadStatus.FINISHED:
-            logger.info("\tdone!")
+            loaded += 1
+            logger.info("\t%s", event.message)
         elif status == LoadStatus.ERROR:
-            logger.info("\t😡 something went horribly wrong!")
+            logger.info("\t😡 %s!", event.message)
+        else:
+            logger.info("\t%s", event.message)
 
         if killer.should_stop and status in LoadStatus.finite_states():
             break
 
+    logger.info("🏁 loaded: %d, skipped: %d, failed: %d, search cache hits: %d, misses: %d",
+                loaded, skipped, failed, loader.cache_hits, loader.cache_misses)
+    if loader.duplicates:
+        logger.info("👯 tracks shared by several playlists: %d", loader.duplicates)
+    for stage, count, total, longest in metrics.summary():
+        logger.info("⏱  %-8s total: %7.1fs, avg: %5.2fs, max: %5.2fs",
+                    stage, total, total / count, longest)
+    if metrics.bytes:
+        logger.info("💾 loaded %.1f MB", metrics.bytes / 1024 / 1024)
+
+
+def read_urls(path: str) -> Iterator[str]:
+    """
+    Stream urls from file or stdin (`-`) line by line, skipping blank lines
+    and comments.
+    """
+    file = sys.stdin if path == '-' else open(path)
+    try:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def batch(path: str, options: dict, output='results'):
+    """
+    Load urls streamed from file as one workload: playlists are resolved
+    while loading, tracks of all of them share one pipeline and the same
+    tracks are loaded once.
+    """
+    from deezload.base import Loader
+
+    loader = Loader(urls=read_urls(path), lazy=True, **options)
+    load(loader, output=output)
+
+
+def list_jobs(store: 'JobStore'):
+    for job in store.jobs():
+        created = datetime.fromtimestamp(job.created).strftime('%Y-%m-%d %H:%M')
+        statuses = ', '.join(f'{k}: {v}' for k, v in sorted(store.track_statuses(job.id).items()))
+        logger.info("#%d  %-8s  %s  %s  (%s)", job.id, job.status, created,
+                    ' '.join(job.options['urls']), statuses)
+
+
+def work(store: 'JobStore', output: Optional[str] = None):
+    from deezload.jobs import run_job, run_worker
+
+    killer = GracefulKiller()
+    for job, loader in run_worker(store):
+        load(loader, run_job(store, job, loader), killer, job.id, output)
+        if killer.should_stop:
+            break
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('urls', type=str, nargs='*',
-                        help="list of URLs")
+                        help="list of URLs, `-` reads them from stdin like --from-file")
     parser.add_argument('-i', dest='index', type=int, default=0,
                         help='start index (default 0)')
     parser.add_argument('-l', dest='limit', type=int, default=50,
@@ -69,13 +148,44 @@ def main():
                         help='activates debug logging (default false)')
     parser.add_argument('-o', dest='output_dir', type=str,
                         help='output directory (default HOME/deezload)')
+    parser.add_argument('-j', dest='jobs', type=int, default=1,
+                        help='number of parallel workers for every stage of '
+                             'loading: search, download, tagging (default 1)')
     parser.add_argument('-f', dest='format', type=str, default='mp3',
-                        help='output audio file format (default mp3)')
+                        help='output audio file format: mp3, flac, aac, m4a, opus, '
+                             'vorbis or wav (default mp3)')
+    parser.add_argument('--no-transcode', dest='transcode', action='store_false',
+                        help="prefer videos with audio already in output format and "
+                             "copy it without re-encoding, works for aac, m4a, opus "
+                             "and vorbis (default false)")
     parser.add_argument('--flat', action='store_false',
                         help='save files as simple list instead of '
                              'as tree: artist/album/song (default false)')
     parser.add_argument('--slug', action='store_true',
                         help="slugify songs names (default false)")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="don't use cache of youtube search results (default false)")
+    parser.add_argument('--detach', action='store_true',
+                        help="put loading into jobs queue instead of running it (default false)")
+    parser.add_argument('--priority', type=int, default=0,
+                        help="priority of queued job, jobs with higher one are loaded "
+                             "first, by web server too (default 0)")
+    parser.add_argument('--worker', action='store_true',
+                        help="process queued and interrupted jobs (default false)")
+    parser.add_argument('--list-jobs', action='store_true',
+                        help="show jobs and their status (default false)")
+    parser.add_argument('--from-file', type=str, default=None, metavar='PATH',
+                        help="read URLs from file line by line (`-` for stdin) and load "
+                             "them as one batch: the same tracks are loaded once and "
+                             "result of every track and of every URL which failed is "
+                             "printed as json line, logs go to stderr")
+    parser.add_argument('--json', action='store_true',
+                        help="print every progress event as json line into stdout: job id, "
+                             "index, status, stage, timings, bytes, eta, track, error, logs "
+                             "go to stderr (default false)")
+    parser.add_argument('--reindex', action='store_true',
+                        help="update index of already loaded files in output "
+                             "directory (default false)")
     parser.add_argument('--ui', type=str, choices=('tk', 'web'), default='tk',
                         help="ui type (default tk)")
     parser.add_argument('--build', type=str, default=None,
@@ -83,26 +193,63 @@ def main():
 
     args = parser.parse_args()
     debug = args.debug or DEBUG
-    setup_logging(debug)
+    from_file = args.from_file or ('-' if args.urls == ['-'] else None)
+    output = 'events' if args.json else 'results' if from_file else None
+    # stdout of batch and json events is kept for them
+    setup_logging(debug, stream=sys.stderr if output else None)
     logger.debug('args: %s', args)
 
     if args.build:
+        from deezload.build import build_app
         build_app(args.build)
         return
 
-    if args.urls:
-        loader = Loader(
-            urls=args.urls,
-            output_dir=args.output_dir,
+    if args.reindex:
+        from deezload.library import Library
+        output_dir = os.path.abspath(args.output_dir or HOME_DIR)
+        logger.info("🔎 indexing %s", output_dir)
+        indexed = Library().reindex(output_dir)
+        logger.info("🏁 indexed files: %d", indexed)
+    elif args.list_jobs:
+        from deezload.jobs import JobStore
+        list_jobs(JobStore())
+    elif args.worker:
+        from deezload.jobs import JobStore
+        work(JobStore(), output)
+    elif args.urls or from_file:
+        options = dict(
+            output_dir=os.path.abspath(args.output_dir or HOME_DIR),
+            index=args.index,
             limit=args.limit,
             format=args.format,
+            transcode=args.transcode,
             tree=not args.flat,
-            slugify=args.slug
+            slugify=args.slug,
+            jobs=args.jobs,
+            cache=args.cache,
         )
-        load(loader)
+        if from_file and not args.detach:
+            batch(from_file, options, output)
+            return
+        from deezload.jobs import JobStatus, JobStore, open_job, run_job
+        # queued batch is read up front, its urls are kept by the job
+        options['urls'] = list(read_urls(from_file)) if from_file else args.urls
+        store = JobStore()
+        if args.detach:
+            job = store.submit(options, priority=args.priority)
+            logger.info("📦 job #%d is queued, run `deezload --worker` to process it", job.id)
+            return
+        job = store.submit(options, JobStatus.RUNNING)
+        loader = open_job(store, job)
+        load(loader, run_job(store, job, loader), job_id=job.id, output=output)
+        # foreground job is kept only to be continued by worker if it's interrupted
+        if store.get(job.id).status == JobStatus.FINISHED:
+            store.delete(job.id)
     elif args.ui == 'web' or UI_TYPE == 'web':
+        from deezload.server import start_server
         start_server(debug)
     else:
+        from deezload.gui import start_app
         start_app()
 
 
@@ -0,0 +1,161 @@
+import time
+from typing import Dict, Iterable, Iterator, Optional
+
+from deezload.base import LoadStatus, Loader, Track
+
+
+# pipeline stage which emits status
+STAGES = {
+    LoadStatus.STARTING: 'search',
+    LoadStatus.SEARCHING: 'search',
+    LoadStatus.LOADING: 'download',
+    LoadStatus.MOVING: 'convert',
+    LoadStatus.RESTORING_META: 'tag',
+}
+
+
+class LoadEvent(object):
+    """
+    Status of one track together with progress of the whole load. The same
+    event is shown by cli, tk gui and web gui and printed as json line.
+    """
+    __slots__ = ('job_id', 'status', 'track', 'index', 'total', 'progress', 'overall',
+                 'elapsed', 'eta', 'playlist', 'url', 'error', 'timings', 'bytes')
+
+    def __init__(self, status: LoadStatus, track: Optional[Track], index: int, total: int,
+                 progress=0.0, overall=0.0, elapsed=0.0, eta: Optional[float] = None,
+                 job_id: Optional[int] = None, playlist: Optional[str] = None,
+                 url: Optional[str] = None, error: Optional[str] = None):
+        self.job_id = job_id
+        self.status = status
+        self.track = track
+        # global index of the track in the load
+        self.index = index
+        # provisional while playlists are resolved
+        self.total = total
+        # of the track and of the whole load, 0..1
+        self.progress = progress
+        self.overall = overall
+        # seconds since the load started and estimated seconds left
+        self.elapsed = elapsed
+        self.eta = eta
+        self.playlist = playlist
+        self.url = url
+        # why source of error event couldn't be loaded
+        self.error = error
+        # track keeps changing while it's loaded, event keeps what it was
+        self.timings: Dict[str, float] = dict(track.timings) if track is not None else {}
+        self.bytes = track.file_size if track is not None else 0
+
+    def __repr__(self):
+        return f'<event {self.status} {self.index + 1}/{self.total}: {self.track}>'
+
+    @property
+    def final(self) -> bool:
+        return self.status in (*LoadStatus.finite_states(), LoadStatus.ERROR)
+
+    @property
+    def stage(self) -> Optional[str]:
+        return STAGES.get(self.status)
+
+    @property
+    def message(self) -> str:
+        track = self.track
+        if self.status == LoadStatus.STARTING:
+            return f'loading: {track.short_name}'
+        if self.status == LoadStatus.SEARCHING:
+            return 'searching for video...'
+        if self.status == LoadStatus.LOADING:
+            return 'loading audio...'
+        if self.status == LoadStatus.MOVING:
+            return 'moving file...'
+        if self.status == LoadStatus.RESTORING_META:
+            return 'restoring meta data...'
+        if self.status == LoadStatus.FAILED:
+            return "wasn't able to find video for track"
+        if self.status == LoadStatus.SKIPPED:
+            return f'track already exists at {track.path}'
+        if self.status == LoadStatus.FINISHED:
+            return 'done!'
+        if self.error is not None:
+            return f"couldn't load {self.url}: {self.error}" if self.url else self.error
+        return 'something went horribly wrong'
+
+    def to_dict(self) -> dict:
+        track = None
+        if self.track is not None:
+            track = dict(self.track.to_dict(), video_id=self.track.video_id,
+                         path=self.track.path)
+        return {
+            'job_id': self.job_id,
+            'index': self.index,
+            'total': self.total,
+            'status': str(self.status),
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'overall': round(self.overall, 4),
+            'elapsed': round(self.elapsed, 3),
+            'eta': self.eta and round(self.eta, 1),
+            'playlist': self.playlist,
+            'url': self.url,
+            'error': self.error,
+            'timings': {stage: round(value, 3) for stage, value in self.timings.items()},
+            'bytes': self.bytes,
+            'track': track,
+        }
+
+
+class Progress(object):
+    """
+    Turns raw `(status, track, index, progress)` events of the load into
+    `LoadEvent`s: counts done tracks and estimates time left by the share
+    of the load which is done so far.
+    """
+
+    def __init__(self, loader: Loader, job_id: Optional[int] = None):
+        self.loader = loader
+        self.job_id = job_id
+        self.start = time.monotonic()
+        self.done = 0
+        # progress of tracks which are loading by their index
+        self.loading: Dict[int, float] = {}
+
+    def event(self, status: LoadStatus, track: Optional[Track], index: int,
+              progress: float) -> LoadEvent:
+        if track is not None:
+            if status in (*LoadStatus.finite_states(), LoadStatus.ERROR):
+                self.loading.pop(index, None)
+                self.done += 1
+            else:
+                self.loading[index] = progress
+        total = max(len(self.loader), index + 1, self.done)
+        overall = min((self.done + sum(self.loading.values())) / total, 1.0)
+        elapsed = time.monotonic() - self.start
+        eta = elapsed * (1 - overall) / overall if overall else None
+        playlist = self.loader.playlist_of(index) if track is not None else None
+        url = playlist and playlist.url
+        error = None
+        if track is None and status == LoadStatus.ERROR and self.loader.failed is not None:
+            url, error = self.loader.failed
+        return LoadEvent(status, track, index, total, progress, overall, elapsed, eta,
+                         job_id=self.job_id,
+                         playlist=playlist and playlist.name,
+                         url=url, error=error)
+
+
+def load_events(loader: Loader, events: Optional[Iterable[tuple]] = None,
+                job_id: Optional[int] = None) -> Iterator[LoadEvent]:
+    """
+    Wrap raw events of `loader.load_gen` (or of `run_job`) into `LoadEvent`s.
+    """
+    progress = Progress(loader, job_id)
+    if events is None:
+        events = loader.load_gen()
+    try:
+        for event in events:
+            yield progress.event(*event)
+    finally:
+        # stopped load cleans up right away
+        close = getattr(events, 'close', None)
+        if close is not None:
+            close()
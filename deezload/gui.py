@@ -1,15 +1,20 @@
 import logging
+import queue
 import threading
 from tkinter import *
 from tkinter import filedialog
 from tkinter.ttk import Progressbar
+from typing import Dict, List
 
 from deezload.base import LoadStatus, Loader
+from deezload.events import load_events
 from deezload.settings import HOME_DIR
 from deezload.utils import setup_logging
 
 
 logger = logging.getLogger(__name__)
+# ms between redraws of download's progress
+POLL_INTERVAL = 100
 
 
 class Application(Frame):
@@ -36,14 +41,22 @@ class Application(Frame):
         self.limit = StringVar(value='50')
         self.use_tree = StringVar(value='1')
         self.slugify = StringVar(value='0')
+        self.jobs = StringVar(value='1')
         self.logs_var = StringVar(value='foo')
         self.should_stop = False
+        # download thread never touches widgets, it posts (kind, value) events
+        # which are drained by main loop every POLL_INTERVAL
+        self.events = queue.Queue()
+        # statuses of tracks in progress by their index
+        self.workers: Dict[int, str] = {}
 
         self.download_btn: Button = None
         self.stop_btn: Button = None
         self.info_label: Label = None
         self.error_label: Label = None
         self.progress: Progressbar = None
+        self.worker_labels: List[Label] = []
+        self.workers_frame: Frame = None
 
         list_params_frame = Frame(self, width=400)
         output_dir_frame = Frame(self, width=400)
@@ -117,15 +130,22 @@ class Application(Frame):
         format_menu = OptionMenu(frame, self.format, *format_options)
         format_menu.grid(row=3, column=1, sticky='w')
 
+        jobs_label = Label(frame, text='Parallel jobs')
+        jobs_label.grid(row=4, column=0, sticky='w')
+
+        jobs_entry = Entry(frame, textvariable=self.jobs, validate="key")
+        jobs_entry['validatecommand'] = (jobs_entry.register(validate_int), '%P', '%d')
+        jobs_entry.grid(row=4, column=1, sticky='w')
+
         tree_checkbox = Checkbutton(frame, text="save as tree (artist / album / song)",
                                     onvalue='1', offvalue='0',
                                     variable=self.use_tree)
-        tree_checkbox.grid(row=4, column=0, sticky='w', columnspan=2)
+        tree_checkbox.grid(row=5, column=0, sticky='w', columnspan=2)
 
         slugify_checkbox = Checkbutton(frame, text="slugify",
                                        onvalue='1', offvalue='0',
                                        variable=self.slugify)
-        slugify_checkbox.grid(row=5, column=0, sticky='w', columnspan=2)
+        slugify_checkbox.grid(row=6, column=0, sticky='w', columnspan=2)
 
     def set_download_frame(self, frame: Frame):
         self.download_btn = Button(frame, text='Download', width=24,
@@ -144,6 +164,10 @@ class Application(Frame):
         self.error_label = Label(frame, font='Helvetica 14 bold', fg='red')
         self.error_label.grid(row=3, sticky='ew', columnspan=2, pady=5)
 
+        # row per track in progress, shown when tracks are loaded in parallel
+        self.workers_frame = Frame(frame)
+        self.workers_frame.grid(row=4, sticky='ew', columnspan=2)
+
     def browse_button(self):
         filename = filedialog.askdirectory()
         if filename:
@@ -152,82 +176,141 @@ class Application(Frame):
     def download_click(self):
         self.download_btn.configure(state=DISABLED)
         self.stop_btn.configure(state=NORMAL)
-        threading.Thread(target=self.download).start()
+        self.show_error('')
+        self.show_msg('loading tracks...')
+        self.set_progress(0)
+        self.set_workers({})
+        # tk variables are read here, in main thread
+        options = dict(
+            urls=self.url.get(),
+            output_dir=self.output_dir.get(),
+            index=int(self.index.get() or 0),
+            # empty field means default limit of the loader, not no tracks
+            limit=int(self.limit.get() or 50),
+            format=self.format.get(),
+            tree=self.use_tree.get() == '1',
+            playlist_name=self.playlist_name.get(),
+            slugify=self.slugify.get() == '1',
+            jobs=int(self.jobs.get() or 1),
+            lazy=True,
+        )
+        threading.Thread(target=self.download, args=(options,)).start()
+        self.after(POLL_INTERVAL, self.poll)
 
     def stop_work(self):
         self.should_stop = True
-        self.show_error('waiting for one last song to load before stop...')
+        self.show_error('waiting for loading songs to finish before stop...')
         self.stop_btn.configure(state=DISABLED)
 
     def show_msg(self, msg: str):
         self.info_label.config(text=msg)
-        self.info_label.update()
 
     def show_error(self, msg: str):
         self.error_label.config(text=msg)
-        self.error_label.update()
 
     def set_progress(self, val: int):
         self.progress['value'] = val
-        self.progress.update()
 
-    def download(self):
+    def set_workers(self, workers: Dict[int, str]):
+        self.workers = workers
+        # single track in progress is shown by info label already
+        lines = [workers[i] for i in sorted(workers)] if len(workers) > 1 else []
+        while len(self.worker_labels) < len(lines):
+            label = Label(self.workers_frame, anchor='w')
+            label.grid(row=len(self.worker_labels), sticky='ew')
+            self.worker_labels.append(label)
+        for label in self.worker_labels[len(lines):]:
+            label.destroy()
+        del self.worker_labels[len(lines):]
+        for label, line in zip(self.worker_labels, lines):
+            label.config(text=line)
+
+    def post(self, kind: str, value=None):
+        self.events.put((kind, value))
+
+    def poll(self):
+        """
+        Apply events posted by download thread since the last poll. Events
+        are coalesced, so widgets are redrawn once per poll no matter how
+        many tracks changed their status in between.
+        """
+        latest = {}
+        workers = dict(self.workers)
+        while True:
+            try:
+                kind, value = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'track':
+                i, line = value
+                if line is None:
+                    workers.pop(i, None)
+                else:
+                    workers[i] = line
+            else:
+                latest[kind] = value
+
+        if 'output_dir' in latest:
+            self.output_dir.set(latest['output_dir'])
+        if 'msg' in latest:
+            self.show_msg(latest['msg'])
+        if 'error' in latest:
+            self.show_error(latest['error'])
+        if 'progress' in latest:
+            self.set_progress(latest['progress'])
+        if workers != self.workers:
+            self.set_workers(workers)
+
+        if 'done' in latest:
+            self.set_workers({})
+            self.download_btn.configure(state=NORMAL)
+            self.stop_btn.configure(state=DISABLED)
+            self.should_stop = False
+        else:
+            self.after(POLL_INTERVAL, self.poll)
+
+    def download(self, options: dict):
+        """
+        Runs in background thread, reports progress with events only.
+        """
         try:
-            self.show_error('')
-            self.show_msg('loading tracks...')
-            loader = Loader(
-                urls=self.url.get(),
-                output_dir=self.output_dir.get(),
-                index=int(self.index.get()),
-                limit=int(self.limit.get()),
-                format=self.format.get(),
-                tree=self.use_tree.get() == '1',
-                playlist_name=self.playlist_name.get(),
-                slugify=self.slugify.get() == '1',
-            )
-            self.set_progress(0)
-            self.output_dir.set(loader.output_dir)
-            self.update()
+            loader = Loader(**options)
+            self.post('output_dir', loader.output_dir)
             loaded, skipped, failed = 0, 0, 0
-            for status, track, i, prog in loader.load_gen():
-                num = f'{i + 1}/{len(loader)}'
-                if status == LoadStatus.STARTING:
-                    self.show_msg(f"{num} - init")
-                elif status == LoadStatus.SEARCHING:
-                    self.show_msg(f"{num} - searching for video")
-                elif status == LoadStatus.LOADING:
-                    self.show_msg(f"{num} - loading video")
-                elif status == LoadStatus.MOVING:
-                    self.show_msg(f"{num} - moving file")
-                elif status == LoadStatus.RESTORING_META:
-                    self.show_msg(f"{num} - restoring audio meta data")
-
-                elif status == LoadStatus.SKIPPED:
+            for event in load_events(loader):
+                status, track = event.status, event.track
+                # total of lazy loader grows while playlists are resolved
+                num = f'{event.index + 1}/{event.total}'
+                if status == LoadStatus.SKIPPED:
                     skipped += 1
                 elif status == LoadStatus.FAILED:
                     failed += 1
                 elif status == LoadStatus.FINISHED:
                     loaded += 1
                     logger.debug('loaded track %s', track)
-
                 elif status == LoadStatus.ERROR:
-                    self.show_error('something went horribly wrong')
+                    self.post('error', event.message)
 
-                self.set_progress(int((i + prog) / len(loader) * 100))
+                if not event.final:
+                    eta = f' (~{event.eta:.0f}s left)' if event.eta is not None else ''
+                    self.post('msg', f'{num} - {event.message}{eta}')
+                if track is not None:
+                    row = None if event.final else f'{num} {track.short_name}: {event.stage}'
+                    self.post('track', (event.index, row))
+                self.post('progress', int(event.overall * 100))
 
                 if self.should_stop and status in LoadStatus.finite_states():
                     break
 
-            self.set_progress(100)
-            self.show_msg(f"DONE. loaded: {loaded}, skipped: {skipped}, failed: {failed}")
+            self.post('progress', 100)
+            self.post('msg', f"DONE. loaded: {loaded}, skipped: {skipped}, failed: {failed}, "
+                             f"cache hits: {loader.cache_hits}")
         except Exception as e:
             logger.exception(e)
-            self.show_msg('')
-            self.show_error(str(e))
+            self.post('msg', '')
+            self.post('error', str(e))
         finally:
-            self.download_btn.configure(state=NORMAL)
-            self.stop_btn.configure(state=DISABLED)
-            self.should_stop = False
+            self.post('done')
 
 
 def center(win, width=None, height=None):
@@ -0,0 +1,392 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from itertools import islice
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from deezload.base import LoadStatus, Loader, Playlist, Track, YoutubeDLPool
+from deezload.settings import DATA_DIR, JOB_TIMEOUT
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    # stopped by user, interrupted jobs are queued again instead
+    STOPPED = 'stopped'
+    FAILED = 'failed'
+
+    def __str__(self):
+        return self.value
+
+
+class Job(NamedTuple):
+    id: int
+    # Loader's keyword arguments
+    options: dict
+    status: JobStatus
+    created: float
+    # jobs with higher priority are claimed and loaded first
+    priority: int = 0
+
+
+class JobStore(object):
+    """
+    Durable queue of loads. Keeps options of every job, tracks of resolved
+    playlists with found videos and status of every track, so interrupted
+    job can be continued without resolving and searching again.
+    """
+
+    def __init__(self, path: str = None, timeout=JOB_TIMEOUT):
+        self.path = path or os.path.join(DATA_DIR, 'jobs.sqlite3')
+        self.timeout = timeout
+        self._lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False,
+                                     isolation_level=None, timeout=30)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                options TEXT NOT NULL,
+                status TEXT NOT NULL,
+                resolved INTEGER NOT NULL DEFAULT 0,
+                priority INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                heartbeat REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS playlists (
+                job_id INTEGER NOT NULL,
+                idx INTEGER NOT NULL,
+                name TEXT,
+                PRIMARY KEY (job_id, idx)
+            );
+            CREATE TABLE IF NOT EXISTS tracks (
+                job_id INTEGER NOT NULL,
+                playlist INTEGER NOT NULL,
+                idx INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                video_id TEXT,
+                checked INTEGER NOT NULL DEFAULT 0,
+                status TEXT,
+                PRIMARY KEY (job_id, playlist, idx)
+            );
+        ''')
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')]
+        if 'priority' not in columns:
+            # store created by older version
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0')
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    @staticmethod
+    def _job(row) -> Job:
+        id, options, status, created, priority = row
+        return Job(id, json.loads(options), JobStatus(status), created, priority)
+
+    def submit(self, options: dict, status=JobStatus.QUEUED, priority=0) -> Job:
+        now = time.time()
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                'INSERT INTO jobs (options, status, priority, created, heartbeat) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (json.dumps(options), str(status), priority, now, now)
+            )
+        return Job(cursor.lastrowid, options, status, now, priority)
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT id, options, status, created, priority FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        return row and self._job(row)
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, options, status, created, priority FROM jobs ORDER BY id'
+            ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def claim(self) -> Optional[Job]:
+        """
+        Take queued or abandoned job with the highest priority, the oldest
+        of them, and mark it as running.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                'SELECT id, options, status, created, priority FROM jobs '
+                'WHERE status = ? OR (status = ? AND heartbeat < ?) '
+                'ORDER BY priority DESC, id LIMIT 1',
+                (str(JobStatus.QUEUED), str(JobStatus.RUNNING), now - self.timeout)
+            ).fetchone()
+            if row is None:
+                return
+            conn.execute('UPDATE jobs SET status = ?, heartbeat = ? WHERE id = ?',
+                         (str(JobStatus.RUNNING), now, row[0]))
+        job = self._job(row)
+        return job._replace(status=JobStatus.RUNNING)
+
+    def set_status(self, job_id: int, status: JobStatus):
+        with self.transaction() as conn:
+            conn.execute('UPDATE jobs SET status = ?, heartbeat = ? WHERE id = ?',
+                         (str(status), time.time(), job_id))
+
+    def delete(self, job_id: int):
+        """Forget job together with its playlists and tracks."""
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM tracks WHERE job_id = ?', (job_id,))
+            conn.execute('DELETE FROM playlists WHERE job_id = ?', (job_id,))
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def touch(self, job_id: int):
+        with self.transaction() as conn:
+            conn.execute('UPDATE jobs SET heartbeat = ? WHERE id = ?', (time.time(), job_id))
+
+    @contextmanager
+    def heartbeat(self, job_id: int):
+        """
+        Keep job alive while block is executing.
+        """
+        done = threading.Event()
+
+        def beat():
+            while not done.wait(self.timeout / 4):
+                self.touch(job_id)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def set_playlists(self, job_id: int, playlists: List[Playlist], batch_size=500):
+        """
+        Save resolved playlists. Lazy playlists are consumed while saved,
+        tracks are written in batches, so store isn't locked while the next
+        page is fetched. Job is marked as resolved when all tracks are saved.
+        """
+        for p, playlist in enumerate(playlists):
+            self.add_playlist(job_id, p, playlist.name)
+            tracks = enumerate(playlist.tracks)
+            while True:
+                batch = list(islice(tracks, batch_size))
+                if not batch:
+                    break
+                self.add_tracks(job_id, p, batch)
+        self.set_resolved(job_id)
+
+    def add_playlist(self, job_id: int, playlist: int, name: Optional[str]):
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO playlists (job_id, idx, name) VALUES (?, ?, ?)',
+                (job_id, playlist, name)
+            )
+
+    def add_tracks(self, job_id: int, playlist: int, tracks: List[Tuple[int, Track]]):
+        """
+        Save batch of `(index, track)` pairs. Tracks saved by interrupted
+        resolution keep their videos and statuses.
+        """
+        with self.transaction() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO tracks (job_id, playlist, idx, data) '
+                'VALUES (?, ?, ?, ?)',
+                ((job_id, playlist, i, json.dumps(track.to_dict())) for i, track in tracks)
+            )
+
+    def set_resolved(self, job_id: int):
+        with self.transaction() as conn:
+            conn.execute('UPDATE jobs SET resolved = 1 WHERE id = ?', (job_id,))
+
+    def get_playlists(self, job_id: int, lazy=False) -> Optional[List[Playlist]]:
+        """
+        Restore resolved playlists, None if job wasn't resolved yet.
+
+        :param lazy: tracks are read from the store page by page while
+            playlists are iterated
+        """
+        with self._lock:
+            resolved = self._conn.execute(
+                'SELECT resolved FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            if not resolved or not resolved[0]:
+                return
+            names = self._conn.execute(
+                'SELECT name FROM playlists WHERE job_id = ? ORDER BY idx', (job_id,)
+            ).fetchall()
+            sizes = dict(self._conn.execute(
+                'SELECT playlist, COUNT(*) FROM tracks WHERE job_id = ? GROUP BY playlist',
+                (job_id,)
+            ).fetchall())
+        playlists = []
+        for p, (name,) in enumerate(names):
+            tracks = self._iter_tracks(job_id, p)
+            if lazy:
+                playlists.append(Playlist(name, tracks, sizes.get(p, 0)))
+            else:
+                playlists.append(Playlist(name, list(tracks)))
+        return playlists
+
+    def _iter_tracks(self, job_id: int, playlist: int, page_size=500) -> Iterator[Track]:
+        last = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT idx, data, video_id, checked FROM tracks '
+                    'WHERE job_id = ? AND playlist = ? AND idx > ? ORDER BY idx LIMIT ?',
+                    (job_id, playlist, last, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            for last, data, video_id, checked in rows:
+                track = Track.from_dict(json.loads(data))
+                track.video_id = video_id
+                track.checked = bool(checked)
+                yield track
+
+    def set_track(self, job_id: int, playlist: int, index: int, track: Track,
+                  status: LoadStatus):
+        with self.transaction() as conn:
+            conn.execute(
+                'UPDATE tracks SET video_id = ?, checked = ?, status = ? '
+                'WHERE job_id = ? AND playlist = ? AND idx = ?',
+                (track.video_id, int(track.checked), str(status), job_id, playlist, index)
+            )
+
+    def track_statuses(self, job_id: int) -> dict:
+        """
+        Number of tracks in every status.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT status, COUNT(*) FROM tracks WHERE job_id = ? GROUP BY status',
+                (job_id,)
+            ).fetchall()
+        return {status or 'pending': count for status, count in rows}
+
+
+def open_job(store: JobStore, job: Job, ydl_pool: Optional[YoutubeDLPool] = None) -> Loader:
+    """
+    Build loader for the job. Playlists are resolved only once per job,
+    later they are restored from the store. Unresolved job gets lazy loader
+    which resolves playlists while loading, `run_job` streams resolved
+    tracks into the store. Restored tracks are read back page by page,
+    so the whole playlist is never kept in memory.
+    """
+    try:
+        playlists = store.get_playlists(job.id, lazy=True)
+        if playlists is None:
+            loader = Loader(**dict(job.options, lazy=True), ydl_pool=ydl_pool)
+        else:
+            loader = Loader(**job.options, playlists=playlists, ydl_pool=ydl_pool)
+    except Exception:
+        store.set_status(job.id, JobStatus.FAILED)
+        raise
+    return loader
+
+
+def run_job(store: JobStore, job: Job, loader: Loader, batch_size=100,
+            stopped: Optional[threading.Event] = None) -> Iterator[tuple]:
+    """
+    Wrap `loader.load_gen` and record status of every track.
+    Job is queued again if generator is closed before the end (signal,
+    client has gone), so worker continues it, or marked as stopped if
+    `stopped` is set: user asked to stop it.
+    Tracks of lazy loader are saved in batches before they are loaded,
+    job is marked as resolved once all of its playlists were read through.
+    """
+    # position of every track in the store, tracks are added as loader
+    # takes them from playlists and removed when they are done
+    keys = {}
+    urls = len(loader.urls)
+    exhausted = set()
+
+    def track_keys(p: int, tracks: Iterable[Track]) -> Iterator[Track]:
+        for i, track in enumerate(tracks):
+            keys[id(track)] = p, i
+            yield track
+
+    def save_tracks(p: int, tracks: Iterable[Track]) -> Iterator[Track]:
+        tracks = enumerate(tracks)
+        while True:
+            batch = list(islice(tracks, batch_size))
+            if not batch:
+                break
+            store.add_tracks(job.id, p, batch)
+            yield from (track for _, track in batch)
+        exhausted.add(p)
+
+    def on_playlist(p: int, playlist: Playlist) -> Playlist:
+        tracks = playlist.tracks
+        if urls:
+            store.add_playlist(job.id, p, playlist.name)
+            tracks = save_tracks(p, tracks)
+        return playlist._replace(tracks=track_keys(p, tracks), size=playlist.length)
+
+    loader.on_playlist = on_playlist
+    recorded = (LoadStatus.LOADING, *LoadStatus.finite_states())
+    status = None
+    store.set_status(job.id, JobStatus.RUNNING)
+    try:
+        with store.heartbeat(job.id):
+            for event in loader.load_gen():
+                track_status, track = event[:2]
+                if track_status in recorded and id(track) in keys:
+                    store.set_track(job.id, *keys[id(track)], track, track_status)
+                if track_status in (*LoadStatus.finite_states(), LoadStatus.ERROR):
+                    keys.pop(id(track), None)
+                yield event
+        status = JobStatus.FINISHED
+        if urls and len(exhausted) == urls:
+            store.set_resolved(job.id)
+    except Exception:
+        status = JobStatus.FAILED
+        raise
+    finally:
+        if status is None:
+            by_user = stopped is not None and stopped.is_set()
+            status = JobStatus.STOPPED if by_user else JobStatus.QUEUED
+        store.set_status(job.id, status)
+
+
+def run_worker(store: JobStore, forever=False, interval=5.0,
+               ydl_pool: Optional[YoutubeDLPool] = None) -> Iterator[tuple]:
+    """
+    Process queued and abandoned jobs one by one. Yields `(job, loader)`
+    pairs, caller is responsible for iterating `run_job`.
+    """
+    while True:
+        job = store.claim()
+        if job is None:
+            if not forever:
+                return
+            time.sleep(interval)
+            continue
+        logger.info('📦 starting job #%d', job.id)
+        try:
+            loader = open_job(store, job, ydl_pool)
+        except Exception as e:
+            logger.exception(e)
+            continue
+        yield job, loader
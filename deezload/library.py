@@ -0,0 +1,129 @@
+import logging
+import os
+import sqlite3
+import threading
+from typing import List, NamedTuple, Optional
+
+import mutagen
+
+from deezload.settings import DATA_DIR
+from deezload.utils import normalise
+
+
+logger = logging.getLogger(__name__)
+AUDIO_EXTENSIONS = ('aac', 'flac', 'mp3', 'm4a', 'opus', 'ogg', 'wav')
+
+
+def make_key(artist: str, album: str, title: str) -> str:
+    return '/'.join(normalise(x, slugify=True) for x in (artist, album, title))
+
+
+class LibraryEntry(NamedTuple):
+    path: str
+    format: str
+    video_id: Optional[str]
+
+
+class Library(object):
+    """
+    Index of already loaded audio files, keyed by normalised
+    (artist, album, title) and by youtube video id.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(DATA_DIR, 'library.sqlite3')
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False,
+                                     isolation_level=None, timeout=30)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                video_id TEXT,
+                format TEXT NOT NULL,
+                mtime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_key ON files (key);
+            CREATE INDEX IF NOT EXISTS files_video_id ON files (video_id);
+        ''')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def __contains__(self, path: str):
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM files WHERE path = ?',
+                                     (os.path.abspath(path),)).fetchone()
+        return row is not None
+
+    def find(self, artist: str, album: str, title: str,
+             video_id: Optional[str] = None) -> List[LibraryEntry]:
+        key = make_key(artist, album, title)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path, format, video_id FROM files WHERE key = ? OR video_id = ?',
+                (key, video_id)
+            ).fetchall()
+        return [LibraryEntry(*row) for row in rows]
+
+    def add(self, path: str, artist: str, album: str, title: str,
+            video_id: Optional[str] = None, mtime: Optional[float] = None):
+        path = os.path.abspath(path)
+        if mtime is None:
+            mtime = os.path.getmtime(path)
+        fmt = os.path.splitext(path)[1].lstrip('.').lower()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (path, key, video_id, format, mtime) '
+                'VALUES (?, ?, COALESCE(?, (SELECT video_id FROM files WHERE path = ?)), ?, ?)',
+                (path, make_key(artist, album, title), video_id, path, fmt, mtime)
+            )
+
+    def remove(self, path: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM files WHERE path = ?', (os.path.abspath(path),))
+
+    def reindex(self, root: str) -> int:
+        """
+        Scan audio files under `root` and index them by their tags.
+        Files with unchanged mtime are not read again, entries of deleted
+        files are removed. Returns number of (re)indexed files.
+        """
+        root = os.path.abspath(root)
+        with self._lock:
+            prefix = os.path.join(root, '')
+            known = dict(self._conn.execute(
+                'SELECT path, mtime FROM files WHERE substr(path, 1, ?) = ?',
+                (len(prefix), prefix)
+            ).fetchall())
+
+        indexed = 0
+        seen = set()
+        for dir_path, _, file_names in os.walk(root):
+            for name in file_names:
+                if os.path.splitext(name)[1].lstrip('.').lower() not in AUDIO_EXTENSIONS:
+                    continue
+                path = os.path.join(dir_path, name)
+                seen.add(path)
+                mtime = os.path.getmtime(path)
+                if known.get(path) == mtime:
+                    continue
+                try:
+                    audio = mutagen.File(path, easy=True)
+                except Exception as e:
+                    logger.debug("couldn't read %s: %s", path, e)
+                    continue
+                if audio is None or audio.tags is None:
+                    continue
+                tags = [audio.tags.get(field) for field in ('artist', 'album', 'title')]
+                if not all(tags):
+                    continue
+                self.add(path, *(tag[0] for tag in tags), mtime=mtime)
+                indexed += 1
+
+        for path in set(known) - seen:
+            self.remove(path)
+        return indexed
@@ -0,0 +1,92 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from deezload.base import LoadStatus, Track
+
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram(object):
+    def __init__(self, buckets: Iterable[float] = DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class Metrics(object):
+    """
+    Aggregates statuses of loaded tracks: number of tracks in every final
+    status, loaded bytes and histograms of stage durations.
+    """
+
+    def __init__(self):
+        self.tracks: Dict[str, int] = defaultdict(int)
+        self.bytes = 0
+        self.stages: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, status: LoadStatus, track: Track):
+        if status not in (*LoadStatus.finite_states(), LoadStatus.ERROR):
+            return
+        with self._lock:
+            self.tracks[str(status)] += 1
+            if track is None:
+                return
+            for stage, duration in track.timings.items():
+                if stage not in self.stages:
+                    self.stages[stage] = Histogram()
+                self.stages[stage].observe(duration)
+            if status == LoadStatus.FINISHED:
+                self.bytes += track.file_size
+
+    def summary(self) -> List[Tuple[str, int, float, float]]:
+        """
+        (stage, count, total seconds, max seconds) of every stage.
+        """
+        with self._lock:
+            return [
+                (stage, hist.count, hist.sum, hist.max)
+                for stage, hist in self.stages.items()
+            ]
+
+    def render(self) -> str:
+        """
+        Metrics in prometheus text format.
+        """
+        lines = [
+            '# HELP deezload_tracks_total Number of processed tracks by final status.',
+            '# TYPE deezload_tracks_total counter',
+        ]
+        with self._lock:
+            for status in (*LoadStatus.finite_states(), LoadStatus.ERROR):
+                lines.append(f'deezload_tracks_total{{status="{status}"}} '
+                             f'{self.tracks[str(status)]}')
+            lines += [
+                '# HELP deezload_downloaded_bytes_total Size of loaded audio files.',
+                '# TYPE deezload_downloaded_bytes_total counter',
+                f'deezload_downloaded_bytes_total {self.bytes}',
+                '# HELP deezload_stage_duration_seconds Duration of loading stages.',
+                '# TYPE deezload_stage_duration_seconds histogram',
+            ]
+            name = 'deezload_stage_duration_seconds'
+            for stage, hist in sorted(self.stages.items()):
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines += [
+                    f'{name}_bucket{{stage="{stage}",le="+Inf"}} {hist.count}',
+                    f'{name}_sum{{stage="{stage}"}} {hist.sum}',
+                    f'{name}_count{{stage="{stage}"}} {hist.count}',
+                ]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,125 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+
+logger = logging.getLogger(__name__)
+_STOP = object()
+
+
+class Stage(NamedTuple):
+    """
+    `func(item, emit)` processes one item and returns True if item
+    should be passed to the next stage.
+    """
+    name: str
+    func: Callable[[Any, Callable], bool]
+    workers: int = 1
+
+
+class Pipeline(object):
+    """
+    Chain of worker pools connected with bounded queues.
+
+    Items are fed into the first stage from background thread, every stage
+    runs its own pool of workers. Events emitted by stages are yielded from
+    `run` in the order they were emitted. After `run` generator is closed
+    pipeline stops accepting new items and no stage starts another item,
+    only the ones that are being worked on are finished.
+    """
+
+    def __init__(self, stages: List[Stage], maxsize=0,
+                 on_error: Optional[Callable[[Any, Exception], None]] = None):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.on_error = on_error
+        self.events = queue.Queue()
+        self.stopped = threading.Event()
+        self._idle = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._fed = False
+        self._queues = [queue.Queue(maxsize) for _ in stages]
+
+    def emit(self, *event):
+        self.events.put(event)
+
+    def _finish(self):
+        with self._lock:
+            self._pending -= 1
+            self._check_idle()
+
+    def _check_idle(self):
+        if self._fed and self._pending == 0 and not self._idle.is_set():
+            self._idle.set()
+            self.events.put(_STOP)
+
+    def _feed(self, items: Iterable):
+        try:
+            for item in items:
+                if self.stopped.is_set():
+                    break
+                with self._lock:
+                    self._pending += 1
+                self._queues[0].put(item)
+        except Exception as e:
+            self._fail(None, e)
+        finally:
+            with self._lock:
+                self._fed = True
+                self._check_idle()
+
+    def _fail(self, item, e: Exception):
+        logger.exception(e)
+        if self.on_error:
+            self.on_error(item, e)
+
+    def _work(self, index: int):
+        stage = self.stages[index]
+        inbox = self._queues[index]
+        is_last = index == len(self.stages) - 1
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                break
+            # don't start new items after stop, in any stage
+            if self.stopped.is_set():
+                self._finish()
+                continue
+            try:
+                passed = stage.func(item, self.emit)
+            except Exception as e:
+                self._fail(item, e)
+                passed = False
+            if passed and not is_last:
+                self._queues[index + 1].put(item)
+            else:
+                self._finish()
+
+    def run(self, items: Iterable) -> Iterator[tuple]:
+        workers = []
+        for index, stage in enumerate(self.stages):
+            for n in range(max(1, stage.workers)):
+                worker = threading.Thread(target=self._work, args=(index,),
+                                          name=f'{stage.name}-{n}', daemon=True)
+                worker.start()
+                workers.append(worker)
+        feeder = threading.Thread(target=self._feed, args=(items,), daemon=True)
+        feeder.start()
+
+        try:
+            while True:
+                event = self.events.get()
+                if event is _STOP:
+                    break
+                yield event
+        finally:
+            self.stopped.set()
+            feeder.join()
+            self._idle.wait()
+            for index, stage in enumerate(self.stages):
+                for _ in range(max(1, stage.workers)):
+                    self._queues[index].put(_STOP)
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,119 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class Session(object):
+    """
+    Load of one user. Its workers take budgets' slots through the session.
+    """
+
+    def __init__(self, scheduler: 'Scheduler', user: str, weight=1.0, priority=0):
+        self.scheduler = scheduler
+        self.user = user
+        self.weight = weight
+        self.priority = priority
+        # grows by 1 / weight with every taken slot
+        self.vtime = 0.0
+        # number of waiting and working workers by budget
+        self.waiting = Counter()
+        self.active = Counter()
+
+    def __repr__(self):
+        return f'<session {self.user!r} priority={self.priority} weight={self.weight}>'
+
+    @property
+    def idle(self) -> bool:
+        return not any(self.waiting.values()) and not any(self.active.values())
+
+    @contextmanager
+    def slot(self, budget: str):
+        self.scheduler.acquire(self, budget)
+        try:
+            yield
+        finally:
+            self.scheduler.release(self, budget)
+
+
+class Scheduler(object):
+    """
+    Global budgets of workers (downloads, conversions) shared by loads of
+    all users. Free slot is taken by waiting session with the highest
+    priority, sessions of the same priority take turns weighted by their
+    `weight` (start-time fair queueing), so the load of a few thousand
+    tracks doesn't starve the load of one album. Every user holds at most
+    `user_cap` slots of a budget, 0 is unlimited.
+    """
+
+    def __init__(self, budgets: Dict[str, int], user_cap=0):
+        self.budgets = dict(budgets)
+        self.user_cap = user_cap
+        self.free = dict(budgets)
+        # sessions which wait for slots or hold them
+        self.sessions: List[Session] = []
+        self._users = Counter()
+        self._cond = threading.Condition()
+
+    def session(self, user: str, weight=1.0, priority=0) -> Session:
+        return Session(self, user, weight, priority)
+
+    def _join(self, session: Session):
+        if session in self.sessions:
+            return
+        # returning session gets no credit for the time it was idle
+        if self.sessions:
+            session.vtime = max(session.vtime, min(s.vtime for s in self.sessions))
+        self.sessions.append(session)
+
+    def _leave(self, session: Session):
+        if session.idle and session in self.sessions:
+            self.sessions.remove(session)
+
+    def _next(self, budget: str) -> Optional[Session]:
+        waiting = [
+            s for s in self.sessions
+            if s.waiting[budget] and (not self.user_cap or
+                                      self._users[s.user, budget] < self.user_cap)
+        ]
+        # the first of equal sessions is the one which waits longer
+        return min(waiting, key=lambda s: (-s.priority, s.vtime), default=None)
+
+    def acquire(self, session: Session, budget: str):
+        if budget not in self.budgets:
+            return
+        with self._cond:
+            self._join(session)
+            session.waiting[budget] += 1
+            try:
+                while self.free[budget] <= 0 or self._next(budget) is not session:
+                    self._cond.wait()
+            finally:
+                session.waiting[budget] -= 1
+            self.free[budget] -= 1
+            session.active[budget] += 1
+            self._users[session.user, budget] += 1
+            session.vtime += 1 / session.weight
+            # the next waiting session may be eligible too
+            self._cond.notify_all()
+
+    def release(self, session: Session, budget: str):
+        if budget not in self.budgets:
+            return
+        with self._cond:
+            self.free[budget] += 1
+            session.active[budget] -= 1
+            self._users[session.user, budget] -= 1
+            self._leave(session)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, dict]:
+        with self._cond:
+            return {
+                budget: {
+                    'size': size,
+                    'busy': size - self.free[budget],
+                    'waiting': sum(s.waiting[budget] for s in self.sessions),
+                }
+                for budget, size in self.budgets.items()
+            }
@@ -0,0 +1,153 @@
+import codecs
+import html
+import json
+import re
+from typing import Iterable, List, NamedTuple, Optional
+from urllib.parse import parse_qs
+
+from deezload.settings import DURATION_TOLERANCE, MAX_AUDIO_SIZE
+
+
+# video's data in results page: "videoRenderer":{"videoId":"..." ... next one
+RENDERER_PREFIX = '"videoRenderer":{"videoId":"'
+RENDERER_REGEX = re.compile(re.escape(RENDERER_PREFIX) + r'([\w-]{11})"')
+TITLE_REGEX = re.compile(r'"title":\{"runs":\[\{"text":"((?:[^"\\]|\\.)*)"')
+LENGTH_REGEX = re.compile(r'"lengthText":\{.{0,500}?"simpleText":"([\d:]+)"', re.S)
+LINK_REGEX = re.compile(r'/watch\?([^"]+)"', re.I | re.M | re.U)
+# mobile page embeds its data as js string with escaped quotes and brackets
+HEX_ESCAPE_REGEX = re.compile(r'\\x([0-9a-fA-F]{2})')
+# words which mark other versions of the song, unless track's title has them too
+UNWANTED_WORDS = {'live', 'cover', 'remix', 'karaoke', 'instrumental', 'acoustic',
+                  'reaction', 'lesson', 'tutorial', 'slowed', 'reverb', 'nightcore'}
+# renderers of videos are mostly shorter than that
+MAX_RENDERER_SIZE = 64 * 1024
+
+
+class SearchResult(NamedTuple):
+    video_id: str
+    title: Optional[str] = None
+    # seconds
+    duration: Optional[int] = None
+
+
+def tokenize(s: str) -> List[str]:
+    return re.findall(r'\w+', s.lower())
+
+
+def parse_duration(text: str) -> int:
+    seconds = 0
+    for part in text.split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def extract_video_id(qs: str) -> Optional[str]:
+    qs = html.unescape(qs)
+    qs = parse_qs(qs)
+    if 'v' in qs:
+        return qs['v'][0]
+
+
+class ResultsParser(object):
+    """
+    Incremental parser of youtube search results page. Page is fed chunk
+    by chunk, parser is done when it has `limit` videos, so the rest of
+    the page doesn't have to be loaded. Pages without video renderers fall
+    back to plain links to videos, which don't have title and duration.
+    """
+
+    def __init__(self, limit=5):
+        self.limit = limit
+        self.results: List[SearchResult] = []
+        self.links: List[SearchResult] = []
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        # decoded text which may contain unfinished renderer or link
+        self._buffer = ''
+        # escape sequence cut by the end of chunk
+        self._tail = ''
+
+    @property
+    def done(self) -> bool:
+        return len(self.results) >= self.limit
+
+    def feed(self, chunk: bytes, final=False):
+        text = self._tail + self._decoder.decode(chunk, final)
+        cut = -1 if final else text.rfind('\\', -3)
+        self._tail = text[cut:] if cut != -1 else ''
+        text = text[:cut] if cut != -1 else text
+        text = self._buffer + HEX_ESCAPE_REGEX.sub(lambda m: chr(int(m.group(1), 16)), text)
+
+        if len(self.links) < self.limit:
+            for match in LINK_REGEX.finditer(text):
+                video_id = extract_video_id(match.group(1))
+                if video_id and all(r.video_id != video_id for r in self.links):
+                    self.links.append(SearchResult(video_id))
+
+        # renderer is parsed once the next one starts, so all of its fields are here
+        keep = max(0, len(text) - len(RENDERER_PREFIX) - 12)
+        starts = list(RENDERER_REGEX.finditer(text))
+        for match, next_match in zip(starts, starts[1:] + [None]):
+            if self.done:
+                break
+            end = next_match.start() if next_match else len(text)
+            if next_match is None and not final and end - match.end() < MAX_RENDERER_SIZE:
+                keep = match.start()
+                break
+            self._add(match.group(1), text[match.end():min(end, match.end() + MAX_RENDERER_SIZE)])
+        self._buffer = text[keep:]
+
+    def _add(self, video_id: str, renderer: str):
+        if any(r.video_id == video_id for r in self.results):
+            return
+        title = TITLE_REGEX.search(renderer)
+        if title is not None:
+            try:
+                title = json.loads(f'"{title.group(1)}"')
+            except ValueError:
+                title = title.group(1)
+        length = LENGTH_REGEX.search(renderer)
+        duration = length and parse_duration(length.group(1))
+        self.results.append(SearchResult(video_id, title, duration))
+
+    def candidates(self) -> List[SearchResult]:
+        return self.results[:self.limit] or self.links[:self.limit]
+
+
+def score(result: SearchResult, song_name: str, duration: Optional[int] = None) -> float:
+    """
+    How well video matches the song: share of song's words in video's title
+    minus penalties for other versions of the song and for difference of
+    durations. Videos without title and duration aren't penalised.
+    """
+    if result.title is None:
+        return 0.0
+    tokens = set(tokenize(song_name))
+    words = set(tokenize(result.title))
+    value = len(tokens & words) / max(len(tokens), 1)
+    value -= 0.5 * len(UNWANTED_WORDS & words - tokens)
+    if duration and result.duration:
+        value -= min(abs(result.duration - duration) / duration, 1.0)
+    return value
+
+
+def rank(results: Iterable[SearchResult], song_name: str,
+         duration: Optional[int] = None) -> List[SearchResult]:
+    # equally good results keep their order, youtube ranks them too
+    return sorted(results, key=lambda r: score(r, song_name, duration), reverse=True)
+
+
+def check_video(info: Optional[dict], duration: Optional[int] = None,
+                tolerance=DURATION_TOLERANCE, max_size=MAX_AUDIO_SIZE) -> Optional[str]:
+    """
+    Reason to reject video by its youtube_dl info, None if video fits the
+    track: "full album" or "10 hours" videos of a song are too long and
+    too big.
+    """
+    if info is None:
+        return 'video is unavailable'
+    length = info.get('duration')
+    if duration and length and abs(length - duration) > duration * tolerance:
+        return f'duration is {length:.0f}s instead of {duration}s'
+    size = info.get('filesize') or info.get('filesize_approx')
+    if max_size and size and size > max_size:
+        return f'audio size is {size / 1024 / 1024:.0f} MB'
@@ -1,21 +1,47 @@
+import asyncio
 import json
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pprint import pprint
-from typing import Union
+from typing import AsyncIterator, Iterator, List, Optional, Union
 
 from sanic import Sanic
 from sanic.request import Request
-from sanic.response import html
+from sanic.response import html, json as json_response, text
 from sanic.websocket import WebSocketCommonProtocol as WebSocket
 
-from deezload.base import AppException, LoadStatus, Loader
-from deezload.settings import HOME_DIR, ROOT_PATH
+from deezload.base import AppException, LoadStatus, YoutubeDLPool, get_ytdl_options
+from deezload.events import LoadEvent, load_events
+from deezload.jobs import JobStatus, JobStore, open_job, run_job, run_worker
+from deezload.metrics import Metrics
+from deezload.scheduler import Scheduler
+from deezload.settings import HOME_DIR, ROOT_PATH, SERVER_DOWNLOAD_WORKERS, SERVER_MAX_JOBS, \
+    SERVER_MAX_LOADS, SERVER_STATUS_RATE, SERVER_TRANSCODE_WORKERS, SERVER_USER_WORKERS
 
 
 app = Sanic()
 app.static('/static', os.path.join(ROOT_PATH, 'static'))
 logger = logging.getLogger(__name__)
+# loaders are blocking, so they run in threads outside of event loop
+executor = ThreadPoolExecutor(max_workers=SERVER_MAX_LOADS)
+store: JobStore = None
+metrics = Metrics()
+# downloads and conversions of all loads are shared fairly between users
+scheduler = Scheduler({
+    'download': SERVER_DOWNLOAD_WORKERS,
+    'transcode': SERVER_TRANSCODE_WORKERS,
+}, user_cap=SERVER_USER_WORKERS)
+# user of jobs loaded in background
+BACKGROUND_USER = 'background'
+# loads watched by their users get bigger share than background jobs
+FOREGROUND_WEIGHT = 2
+# youtube_dl instances are shared by all loads of the server, every
+# download slot uses one at a time
+ydl_pool = YoutubeDLPool(max_idle=SERVER_DOWNLOAD_WORKERS)
+_done = object()
 
 
 async def recv(ws: WebSocket) -> dict:
@@ -36,7 +62,70 @@ async def send_message(ws: WebSocket, type_: str,
     await ws.send(json.dumps(out))
 
 
-async def load_cycle(ws: WebSocket):
+async def iterate_in_executor(gen: Iterator, stop: threading.Event,
+                              timeout: Optional[float] = None) -> AsyncIterator:
+    """
+    Iterate blocking generator in executor and pass its items back to event
+    loop through the queue. Generator is closed as soon as `stop` is set.
+    If there were no items for `timeout` seconds None is yielded.
+    """
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for item in gen:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            gen.close()
+            loop.call_soon_threadsafe(queue.put_nowait, _done)
+
+    loop.run_in_executor(executor, produce)
+    while True:
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            yield None
+            continue
+        if item is _done:
+            break
+        yield item
+
+
+async def receive_stop(ws: WebSocket, stop: threading.Event):
+    """
+    Listen for out-of-band stop message while loading is in progress.
+    """
+    while not stop.is_set():
+        data = await recv(ws)
+        if data['type'] == 'stop':
+            stop.set()
+
+
+def add_status(statuses: List[dict], status: dict):
+    """
+    Add status to not yet sent batch. Intermediate statuses of the same track
+    are replaced by newer one.
+    """
+    intermediate = (
+        str(LoadStatus.SEARCHING),
+        str(LoadStatus.LOADING),
+        str(LoadStatus.MOVING),
+        str(LoadStatus.RESTORING_META),
+    )
+    if status['status'] in intermediate:
+        statuses[:] = [
+            s for s in statuses
+            if s['index'] != status['index'] or s['status'] not in intermediate
+        ]
+    statuses.append(status)
+
+
+async def load_cycle(request: Request, ws: WebSocket):
     await send_message(ws, 'setup', {
         'output_dir': HOME_DIR
     })
@@ -45,17 +134,30 @@ async def load_cycle(ws: WebSocket):
     if data['type'] != 'start':
         return
 
+    options = dict(
+        urls=[data.get('url')],
+        output_dir=os.path.abspath(data.get('output_dir') or HOME_DIR),
+        index=data.get('index'),
+        limit=data.get('limit'),
+        format=data.get('format'),
+        transcode=not data.get('copy'),
+        tree=data.get('tree'),
+        playlist_name=data.get('playlist') or None,
+        slugify=data.get('slugify'),
+        jobs=min(data.get('jobs') or 1, SERVER_MAX_JOBS),
+    )
+    if data.get('background'):
+        job = store.submit(options)
+        await send_message(ws, 'submitted', {
+            'job_id': job.id,
+        })
+        return
+
     try:
-        loader = Loader(
-            urls=data.get('url'),
-            output_dir=data.get('output_dir'),
-            index=data.get('index'),
-            limit=data.get('limit'),
-            format=data.get('format'),
-            tree=data.get('tree'),
-            playlist_name=data.get('playlist') or None,
-            slugify=data.get('slugify')
-        )
+        job = store.submit(options, JobStatus.RUNNING)
+        # job store is blocking too, playlists are resolved while loading
+        loader = await asyncio.get_event_loop().run_in_executor(
+            None, partial(open_job, store, job, ydl_pool))
         await send_message(ws, 'start')
 
     except AppException as e:
@@ -67,68 +169,92 @@ async def load_cycle(ws: WebSocket):
         await send_message(ws, 'error', str(e))
         return
 
-    # share playlist name
-    name = loader.playlists[0].name
+    # share playlist name, lazy loader knows it only after resolving
+    def playlist_name():
+        return loader.playlists[0].name if loader.playlists else None
+
     await send_message(ws, 'before_load', {
-        'playlist_name': name
+        'playlist_name': playlist_name()
     })
 
-    should_stop = False
+    loop = asyncio.get_event_loop()
+    interval = 1 / SERVER_STATUS_RATE
+    # stop requested by client
+    stop_requested = threading.Event()
+    # stop loader
+    stop = threading.Event()
+    receiver = asyncio.ensure_future(receive_stop(ws, stop_requested))
+
+    statuses = []
+    last_sent = 0
+    # the latest event, progress of the whole load is sent with statuses
+    last_event: Optional[LoadEvent] = None
     loaded, skipped, failed = 0, 0, 0
-    for status, track, i, prog in loader.load_gen():
-        if status == LoadStatus.STARTING:
-            message = track.short_name
-        elif status == LoadStatus.SEARCHING:
-            message = "searching for video..."
-        elif status == LoadStatus.LOADING:
-            message = "loading audio..."
-        elif status == LoadStatus.MOVING:
-            message = f"moving file..."
-        elif status == LoadStatus.RESTORING_META:
-            message = "restoring meta data..."
-
-        elif status == LoadStatus.FAILED:
-            message = "wasn't able to find video for track"
-            failed += 1
-        elif status == LoadStatus.SKIPPED:
-            message = f"track already exists at {track.path}"
-            skipped += 1
-        elif status == LoadStatus.FINISHED:
-            loaded += 1
-            message = "done!"
-
-        elif status == LoadStatus.ERROR:
-            message = '😡 something went horribly wrong 😡'
-        else:
-            message = None
-
-        if message:
-            await send_message(ws, 'status', {
-                'message': message,
-                'status': str(status),
-                'index': i,
-                'prog': prog,
-                'size': len(loader)
-            })
-            resp = await recv(ws)
-            if resp['type'] == 'stop':
-                should_stop = True
-
-        if should_stop and status in LoadStatus.finite_states():
-            break
+
+    async def send_statuses():
+        nonlocal statuses, last_sent
+        await send_message(ws, 'statuses', {
+            'statuses': statuses,
+            # total is provisional while playlists are resolved
+            'total': last_event.total if last_event else len(loader),
+            'playlist_name': playlist_name(),
+            'progress': last_event.overall * 100 if last_event else 0,
+            'eta': last_event and last_event.eta,
+        })
+        statuses = []
+        last_sent = loop.time()
+
+    loader.session = scheduler.session(request.ip, weight=FOREGROUND_WEIGHT)
+    try:
+        events = load_events(loader, run_job(store, job, loader, stopped=stop_requested),
+                             job.id)
+        async for event in iterate_in_executor(events, stop, timeout=interval):
+            status = None
+            if event is not None:
+                last_event = event
+                status = event.status
+                metrics.observe(status, event.track)
+                if status == LoadStatus.FAILED:
+                    failed += 1
+                elif status == LoadStatus.SKIPPED:
+                    skipped += 1
+                elif status == LoadStatus.FINISHED:
+                    loaded += 1
+                add_status(statuses, {
+                    'message': event.message,
+                    'status': str(status),
+                    'stage': event.stage,
+                    'index': event.index,
+                })
+            if statuses and loop.time() - last_sent >= interval:
+                await send_statuses()
+
+            if stop_requested.is_set() and status in LoadStatus.finite_states():
+                break
+        if statuses:
+            await send_statuses()
+    finally:
+        # also stops loader if client has gone
+        stop.set()
+        receiver.cancel()
+    # interactive load is kept only to be continued if it's interrupted
+    if store.get(job.id).status == JobStatus.FINISHED:
+        store.delete(job.id)
 
     await send_message(ws, 'complete', {
         'loaded': loaded,
         'skipped': skipped,
         'failed': failed,
+        'cache_hits': loader.cache_hits,
+        'cache_misses': loader.cache_misses,
     })
 
 
 @app.websocket('/load')
-async def load(_: Request, ws: WebSocket):
+async def load(request: Request, ws: WebSocket):
     while True:
         logger.info('♻️ NEW CYCLE ♻️')
-        await load_cycle(ws)
+        await load_cycle(request, ws)
 
 
 @app.route("/")
@@ -136,5 +262,63 @@ async def index(_):
     return html(open(os.path.join(ROOT_PATH, 'index.html')).read())
 
 
+@app.route("/jobs")
+async def jobs(_):
+    return json_response([
+        {
+            'id': job.id,
+            'status': str(job.status),
+            'created': job.created,
+            'urls': job.options['urls'],
+            'tracks': store.track_statuses(job.id),
+        }
+        for job in store.jobs()
+    ])
+
+
+@app.route("/metrics")
+async def metrics_view(_):
+    lines = [
+        metrics.render().rstrip('\n'),
+        '# HELP deezload_scheduler_slots Workers of budgets shared by loads.',
+        '# TYPE deezload_scheduler_slots gauge',
+    ]
+    for budget, stats in scheduler.stats().items():
+        for key, value in stats.items():
+            lines.append(f'deezload_scheduler_slots{{budget="{budget}",state="{key}"}} {value}')
+    return text('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
+
+
+def work():
+    """
+    Process submitted jobs and jobs interrupted by restart in background.
+    """
+    for job, loader in run_worker(store, forever=True, ydl_pool=ydl_pool):
+        loader.session = scheduler.session(BACKGROUND_USER, priority=job.priority)
+        try:
+            for status, track, *_ in run_job(store, job, loader):
+                metrics.observe(status, track)
+        except Exception as e:
+            logger.exception(e)
+        logger.info('📦 job #%d is done', job.id)
+
+
+@app.listener('before_server_start')
+async def start_worker(*_):
+    global store
+    store = JobStore()
+    threading.Thread(target=work, daemon=True).start()
+    # instances for default options are ready before the first load,
+    # loaders download raw audio and convert it themselves
+    options = get_ytdl_options(HOME_DIR, extract_audio=False)
+    threading.Thread(target=ydl_pool.warm, args=(options, SERVER_DOWNLOAD_WORKERS),
+                     daemon=True).start()
+
+
+@app.listener('after_server_stop')
+async def close_pool(*_):
+    ydl_pool.close()
+
+
 def start_server(debug=False):
     app.run(host="0.0.0.0", port=8000, debug=debug)
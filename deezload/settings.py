@@ -8,3 +8,48 @@ UI_TYPE = os.environ.get('DEEZLOAD_UI', 'tk').lower()
 
 default_home_dir = os.path.join(str(Path.home()), 'deezload')
 HOME_DIR = os.environ.get('DEEZLOAD_HOME', default_home_dir)
+
+CACHE_DIR = os.environ.get('DEEZLOAD_CACHE_DIR', os.path.join(HOME_DIR, '.cache'))
+# youtube search results cache: time to live (in seconds) and max number of entries
+SEARCH_CACHE_TTL = int(os.environ.get('DEEZLOAD_SEARCH_CACHE_TTL', 30 * 24 * 60 * 60))
+SEARCH_CACHE_SIZE = int(os.environ.get('DEEZLOAD_SEARCH_CACHE_SIZE', 100000))
+# youtube_dl's own cache (decrypted signature functions), shared by all loads
+YOUTUBE_DL_CACHE_DIR = os.environ.get('DEEZLOAD_YOUTUBE_DL_CACHE_DIR',
+                                      os.path.join(CACHE_DIR, 'youtube-dl'))
+
+# number of parallel ffmpeg processes converting loaded audio of one load
+TRANSCODE_WORKERS = int(os.environ.get('DEEZLOAD_TRANSCODE_WORKERS', os.cpu_count() or 1))
+
+# size of http connections pool and max number of parallel api requests
+HTTP_POOL_SIZE = int(os.environ.get('DEEZLOAD_HTTP_POOL_SIZE', 16))
+HTTP_TIMEOUT = float(os.environ.get('DEEZLOAD_HTTP_TIMEOUT', 30))
+# max requests per second to deezer api and youtube search, 0 disables the limit
+DEEZER_RATE_LIMIT = float(os.environ.get('DEEZLOAD_DEEZER_RATE_LIMIT', 10))
+YOUTUBE_RATE_LIMIT = float(os.environ.get('DEEZLOAD_YOUTUBE_RATE_LIMIT', 10))
+# number of first youtube search results which are ranked to find the best video
+YOUTUBE_SEARCH_CANDIDATES = int(os.environ.get('DEEZLOAD_YOUTUBE_SEARCH_CANDIDATES', 5))
+# videos whose duration differs from track's one by more than that fraction,
+# or whose audio is bigger than that many megabytes, aren't downloaded
+DURATION_TOLERANCE = float(os.environ.get('DEEZLOAD_DURATION_TOLERANCE', 0.25))
+MAX_AUDIO_SIZE = float(os.environ.get('DEEZLOAD_MAX_AUDIO_SIZE', 100)) * 1024 * 1024
+# retries of throttled or failed requests, delays grow exponentially from
+# HTTP_BACKOFF up to HTTP_BACKOFF_MAX seconds
+HTTP_RETRIES = int(os.environ.get('DEEZLOAD_HTTP_RETRIES', 5))
+HTTP_BACKOFF = float(os.environ.get('DEEZLOAD_HTTP_BACKOFF', 0.5))
+HTTP_BACKOFF_MAX = float(os.environ.get('DEEZLOAD_HTTP_BACKOFF_MAX', 30))
+
+# web server: max number of simultaneous loads and max parallel jobs per load
+SERVER_MAX_LOADS = int(os.environ.get('DEEZLOAD_MAX_LOADS', 16))
+SERVER_MAX_JOBS = int(os.environ.get('DEEZLOAD_MAX_JOBS', 4))
+# web server: downloads and conversions shared by all loads, and max number of
+# them taken by one user
+SERVER_DOWNLOAD_WORKERS = int(os.environ.get('DEEZLOAD_DOWNLOAD_WORKERS', 8))
+SERVER_TRANSCODE_WORKERS = int(os.environ.get('DEEZLOAD_SERVER_TRANSCODE_WORKERS',
+                                              TRANSCODE_WORKERS))
+SERVER_USER_WORKERS = int(os.environ.get('DEEZLOAD_USER_WORKERS', 4))
+# max number of status messages per second sent to web client
+SERVER_STATUS_RATE = float(os.environ.get('DEEZLOAD_STATUS_RATE', 4))
+
+DATA_DIR = os.environ.get('DEEZLOAD_DATA_DIR', os.path.join(HOME_DIR, '.deezload'))
+# running job which didn't report for that long (in seconds) is considered abandoned
+JOB_TIMEOUT = int(os.environ.get('DEEZLOAD_JOB_TIMEOUT', 120))
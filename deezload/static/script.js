@@ -1,7 +1,6 @@
 let loadUrl = new URL('load', window.location.href);
 loadUrl.protocol = loadUrl.protocol.replace('http', 'ws');
 let socket = new WebSocket(loadUrl.href);
-let stopLoad = false;
 let errorIsVisible = false;
 
 let mainWin = document.getElementById('main-win');
@@ -17,11 +16,11 @@ let downloadButton = document.getElementById('download-btn');
 let stopButton = document.getElementById('stop-btn');
 let finishButton = document.getElementById('finish-btn');
 
-function setProgress(proc) {
+function setProgress(proc, eta = null) {
     proc = Math.round(proc);
     proc = `${proc}%`;
     progress.style.width = proc;
-    progress.textContent = proc;
+    progress.textContent = eta === null ? proc : `${proc} (~${Math.round(eta)}s left)`;
 }
 
 function addLog(cls, msg, left = true) {
@@ -34,6 +33,16 @@ function addLog(cls, msg, left = true) {
     }
 }
 
+function showError(message, cls = 'error') {
+    removeError();
+    errorIsVisible = true;
+    let error = document.createElement('div');
+    error.classList.add(cls);
+    error.innerText = message;
+    mainWin.appendChild(error);
+    downloadButton.disabled = false;
+}
+
 function removeError() {
     if (errorIsVisible) {
         mainWin.removeChild(mainWin.lastChild);
@@ -43,7 +52,9 @@ function removeError() {
 
 stopButton.onclick = function () {
     addLog('stop-msg', 'wait till one more audio file loads before stop', true);
-    stopLoad = true;
+    socket.send(JSON.stringify({
+        'type': 'stop',
+    }));
 };
 
 finishButton.onclick = function () {
@@ -52,7 +63,6 @@ finishButton.onclick = function () {
     finishButton.style.display = 'none';
     stopButton.style.display = 'block';
     logs.innerHTML = '';
-    stopLoad = false;
     downloadButton.disabled = false;
     setProgress(0);
 };
@@ -69,9 +79,12 @@ mainForm.onsubmit = function (event) {
         'index': parseInt(formData.get('index').toString()),
         'limit': parseInt(formData.get('limit').toString()),
         'format': formData.get('format'),
+        'copy': !!formData.get('copy'),
         'tree': !!formData.get('tree'),
         'slugify': !!formData.get('slugify'),
         'playlist': formData.get('playlist'),
+        'jobs': parseInt(formData.get('jobs').toString()),
+        'background': !!formData.get('background'),
     };
     socket.send(JSON.stringify(data));
 };
@@ -87,39 +100,31 @@ socket.onmessage = function (event) {
     } else if (data.type === 'before_load') {
         playlistName.innerText = data.playlist_name;
 
-    } else if (data.type === 'status') {
-        if (data.status === 'starting') {
-            addLog('start-msg', data.message, true);
-        }
-        else if (data.status === 'failed') {
-            addLog('warn-msg', data.message, false);
+    } else if (data.type === 'statuses') {
+        for (let status of data.statuses) {
+            if (status.status === 'starting') {
+                addLog('start-msg', `${status.index + 1}/${data.total} ${status.message}`, true);
+            }
+            else if (status.status === 'failed') {
+                addLog('warn-msg', status.message, false);
+            }
+            else if (status.status === 'error') {
+                addLog('error-msg', status.message, true);
+            }
+            else {
+                addLog('info-msg', status.message, false);
+            }
         }
-        else if (data.status === 'error') {
-            addLog('error-msg', data.message, true);
+        if (data.playlist_name && !playlistName.innerText) {
+            playlistName.innerText = data.playlist_name;
         }
-        else {
-            addLog('info-msg', data.message, false);
-        }
-
-        let proc = (data.index + data.prog) / data.size * 100;
-        setProgress(proc);
-
-        let respType = 'ok';
-        if (stopLoad) {
-            respType = 'stop';
-        }
-        socket.send(JSON.stringify({
-            'type': respType,
-        }));
+        setProgress(data.progress, data.eta);
 
     } else if (data.type === 'error') {
-        removeError();
-        errorIsVisible = true;
-        let error = document.createElement('div');
-        error.classList.add('error');
-        error.innerText = data.message;
-        mainWin.appendChild(error);
-        downloadButton.disabled = false;
+        showError(data.message);
+
+    } else if (data.type === 'submitted') {
+        showError(`job #${data.job_id} is queued and will be loaded in background`, 'info');
 
     } else if (data.type === 'start') {
         mainWin.style.display = 'none';
@@ -131,7 +136,8 @@ socket.onmessage = function (event) {
 
         let msg = `<div>loaded: ${data.loaded}</div>
                    <div>skipped: ${data.skipped}</div>
-                   <div>failed: ${data.failed}</div>`;
+                   <div>failed: ${data.failed}</div>
+                   <div>search cache hits: ${data.cache_hits}, misses: ${data.cache_misses}</div>`;
         addLog('final-msg', msg);
     }
 };
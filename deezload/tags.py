@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+
+import mutagen
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import APIC, ID3, TALB, TDRC, TIT2, TPE1, TPOS, TRCK, TSRC
+from mutagen.mp4 import MP4Cover, MP4FreeForm, MP4Tags
+
+from deezload import client
+from deezload.settings import CACHE_DIR
+
+
+logger = logging.getLogger(__name__)
+ID3_FRAMES = {
+    'artist': TPE1,
+    'album': TALB,
+    'title': TIT2,
+    'tracknumber': TRCK,
+    'discnumber': TPOS,
+    'date': TDRC,
+    'isrc': TSRC,
+}
+MP4_KEYS = {
+    'artist': '\xa9ART',
+    'album': '\xa9alb',
+    'title': '\xa9nam',
+    'date': '\xa9day',
+}
+MP4_ISRC = '----:com.apple.iTunes:ISRC'
+
+
+class CoverCache(object):
+    """
+    Album covers stored on disk by their url. Every cover is fetched only
+    once even if tracks of the same album are tagged simultaneously.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(CACHE_DIR, 'covers')
+        os.makedirs(self.path, exist_ok=True)
+        self._locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def get(self, url: Optional[str]) -> Optional[bytes]:
+        if not url:
+            return
+        name = hashlib.sha1(url.encode()).hexdigest()
+        path = os.path.join(self.path, name)
+        with self._lock:
+            lock = self._locks[name]
+        with lock:
+            if not os.path.exists(path):
+                try:
+                    res = client.get(url)
+                    res.raise_for_status()
+                except Exception as e:
+                    logger.warning("couldn't fetch cover %s: %s", url, e)
+                    return
+                tmp_path = f'{path}.{threading.get_ident()}'
+                with open(tmp_path, 'wb') as f:
+                    f.write(res.content)
+                os.replace(tmp_path, path)
+            with open(path, 'rb') as f:
+                return f.read()
+
+
+def _picture(cover: bytes) -> Picture:
+    picture = Picture()
+    picture.type = 3  # front cover
+    picture.mime = 'image/jpeg'
+    picture.data = cover
+    return picture
+
+
+def _write_id3(tags: ID3, fields: Dict[str, str], cover: Optional[bytes]):
+    for key, value in fields.items():
+        frame = ID3_FRAMES[key]
+        tags.setall(frame.__name__, [frame(encoding=3, text=value)])
+    if cover:
+        tags.setall('APIC', [APIC(encoding=3, mime='image/jpeg', type=3, data=cover)])
+
+
+def _write_mp4(tags: MP4Tags, fields: Dict[str, str], cover: Optional[bytes]):
+    for key, value in fields.items():
+        if key in MP4_KEYS:
+            tags[MP4_KEYS[key]] = [value]
+        elif key == 'tracknumber':
+            tags['trkn'] = [(int(value), 0)]
+        elif key == 'discnumber':
+            tags['disk'] = [(int(value), 0)]
+        elif key == 'isrc':
+            tags[MP4_ISRC] = [MP4FreeForm(value.encode())]
+    if cover:
+        tags['covr'] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+
+
+def _write_vorbis(audio, fields: Dict[str, str], cover: Optional[bytes]):
+    for key, value in fields.items():
+        audio.tags[key] = value
+    if not cover:
+        return
+    if isinstance(audio, FLAC):
+        audio.clear_pictures()
+        audio.add_picture(_picture(cover))
+    else:
+        data = base64.b64encode(_picture(cover).write()).decode()
+        audio.tags['metadata_block_picture'] = [data]
+
+
+def write(path: str, fields: Dict[str, str], cover: Optional[bytes] = None):
+    """
+    Write all tags and cover into audio file with single save.
+
+    :param fields: tags named as vorbis comments: artist, album, title,
+        tracknumber, discnumber, date, isrc
+    """
+    audio = mutagen.File(path)
+    if audio is None:
+        logger.warning('failed to restore meta: %s', path)
+        return
+    if audio.tags is None:
+        try:
+            audio.add_tags()
+        except Exception as e:
+            logger.warning("file %s doesn't support tags: %s", path, e)
+            return
+    fields = {key: str(value) for key, value in fields.items() if value is not None}
+    if isinstance(audio.tags, ID3):
+        _write_id3(audio.tags, fields, cover)
+    elif isinstance(audio.tags, MP4Tags):
+        _write_mp4(audio.tags, fields, cover)
+    else:
+        _write_vorbis(audio, fields, cover)
+    audio.save()
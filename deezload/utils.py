@@ -1,7 +1,24 @@
 import logging
+import re
 import sys
 
 
+NOT_ALLOWED_PATH_CHARS = set(r'<>:"/\\|?*')
+
+
+def normalise(s: str, slugify=False):
+    """make string path-friendly"""
+    if slugify:
+        s = ''.join(c for c in s if c.isalnum() or c == ' ')
+        s = re.sub(r' +', ' ', s)
+        s = s.lower().replace(' ', '_')
+        return s
+    s = s.replace('"', '\'')
+    s = ''.join(c for c in s if c not in NOT_ALLOWED_PATH_CHARS)
+    s = re.sub(r' +', ' ', s)
+    return s
+
+
 class Formatter(logging.Formatter):
     debug_fmt = '%(levelname)s  %(name)10s:%(lineno)-3d > %(message)s'
     info_fmt = '%(message)s'
@@ -1,12 +1,16 @@
 import glob
 import os
 import shutil
+import time
 import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
 import mutagen
 
-from deezload.base import AppException, DEEZER_API_ROOT, LoadStatus, Loader, PlaylistWriter, \
-    Track, build_api_url, deezer_url, extract_video_id, get_playlist, get_user, get_video_id
+from deezload.base import AppException, DEEZER_API_ROOT, Dedup, LoadStatus, Loader, Playlist, \
+    PlaylistWriter, Task, Track, YoutubeDLPool, build_api_url, deezer_url, extract_video_id, \
+    get_playlist, get_user, get_video_id, get_ytdl_options
 
 
 SKIP_RISKY = os.environ.get('RISKY_TESTS', '0') == '1'
@@ -165,6 +169,45 @@ class BaseTests(unittest.TestCase):
         self.assertTrue(pl.name is None)
         self.assertTrue(len(pl.tracks) > 0)
 
+    def test_get_playlist_pagination(self):
+        total = 250
+        raw_tracks = [
+            {'title': f'song {i}', 'artist': {'name': 'foo'}, 'album': {'title': 'bar'}}
+            for i in range(total)
+        ]
+        requested = []
+
+        def get(url, **_):
+            requested.append(url)
+            res = mock.Mock(status_code=200)
+            parsed = urlparse(url)
+            if parsed.path == '/playlist/1':
+                data = {'title': 'pl', 'nb_tracks': total, 'tracks': {'data': raw_tracks[:100]}}
+            else:
+                qs = parse_qs(parsed.query)
+                index, limit = int(qs['index'][0]), int(qs['limit'][0])
+                data = {'data': raw_tracks[index:index + limit], 'total': total}
+            res.json.return_value = data
+            return res
+
+        with mock.patch('deezload.base.client.get', side_effect=get):
+            pl = get_playlist('https://www.deezer.com/en/playlist/1', index=50, limit=180)
+        self.assertEqual('pl', pl.name)
+        self.assertEqual([f'song {i}' for i in range(50, 230)],
+                         [t.title for t in pl.tracks])
+        self.assertEqual(3, len(requested))
+
+        # lazy playlist fetches pages while it's iterated
+        requested.clear()
+        with mock.patch('deezload.base.client.get', side_effect=get):
+            pl = get_playlist('https://www.deezer.com/en/playlist/1', index=50, limit=180,
+                              lazy=True)
+            self.assertEqual(180, pl.length)
+            self.assertEqual(1, len(requested))
+            self.assertEqual([f'song {i}' for i in range(50, 230)],
+                             [t.title for t in pl.tracks])
+        self.assertEqual(3, len(requested))
+
     @unittest.skipIf(SKIP_SLOW or SKIP_RISKY, 'slow and risky')
     def test_get_video_id(self):
         id = get_video_id('foo bar')
@@ -175,6 +218,14 @@ class BaseTests(unittest.TestCase):
                           'f;nvlkdshirupwenfsdpfosdipfsdnspdofjpow ebroiewhwer')
         self.assertTrue(id is None)
 
+    def test_ytdl_options_no_transcode(self):
+        self.assertEqual('bestaudio/best', get_ytdl_options('.', 'opus')['format'])
+        self.assertEqual('bestaudio[acodec=opus]/bestaudio/best',
+                         get_ytdl_options('.', 'opus', transcode=False)['format'])
+        # mp3 is re-encoded anyway
+        self.assertEqual('bestaudio/best',
+                         get_ytdl_options('.', 'mp3', transcode=False)['format'])
+
     def test_extract_video_id(self):
         id = extract_video_id('v=fds')
         self.assertEqual('fds', id)
@@ -209,6 +260,104 @@ class BaseTests(unittest.TestCase):
         shutil.rmtree(output_dir)
 
 
+class DedupTests(unittest.TestCase):
+    def test_dedup(self):
+        dedup = Dedup()
+        song = Task(0, Track('Artist', 'Song', 'album', deezer_id=1))
+        song.track.path, song.track.video_id = 'song.mp3', 'v1'
+        # the same song from list without deezer ids and from another playlist
+        unknown = Task(1, Track('artist', 'song!', 'album'))
+        same = Task(2, Track('artist', 'song', 'album', deezer_id=1))
+        other = Task(3, Track('artist', 'other song', 'album', deezer_id=1))
+
+        self.assertEqual((True, []), dedup.add(song))
+        self.assertEqual((False, []), dedup.add(unknown))
+        self.assertEqual((False, []), dedup.add(same))
+        # not the first task of the track
+        self.assertEqual([], dedup.done(2, same.track, LoadStatus.FINISHED))
+
+        events = dedup.done(0, song.track, LoadStatus.FINISHED)
+        self.assertEqual([(LoadStatus.SKIPPED, unknown.track, 1, 1),
+                          (LoadStatus.SKIPPED, same.track, 2, 1)], events)
+        self.assertEqual('song.mp3', unknown.track.path)
+        self.assertEqual('v1', same.track.video_id)
+        # duplicate of already loaded track is reported right away
+        passed, events = dedup.add(other)
+        self.assertFalse(passed)
+        self.assertEqual([(LoadStatus.SKIPPED, other.track, 3, 1)], events)
+        self.assertEqual(3, dedup.duplicates)
+
+    def test_dedup_releases(self):
+        dedup = Dedup()
+        song = Task(0, Track('artist', 'song', 'album', deezer_id=1))
+        # another release with the same name, e.g. remaster or live version
+        compilation = Task(1, Track('artist', 'song', 'best of', deezer_id=2))
+        unknown = Task(2, Track('artist', 'song', 'album'))
+        named = Task(3, Track('artist', 'song', 'other'))
+
+        self.assertEqual((True, []), dedup.add(song))
+        self.assertEqual((True, []), dedup.add(compilation))
+        # name is a fallback for track without deezer id
+        self.assertEqual((False, []), dedup.add(unknown))
+        self.assertEqual([], dedup.done(1, compilation.track, LoadStatus.FINISHED))
+        self.assertEqual([(LoadStatus.SKIPPED, unknown.track, 2, 1)],
+                         dedup.done(0, song.track, LoadStatus.FINISHED))
+        self.assertEqual(1, dedup.duplicates)
+
+        # and track with deezer id matches the first one without it by name
+        dedup = Dedup()
+        self.assertEqual((True, []), dedup.add(named))
+        self.assertEqual((False, []), dedup.add(compilation))
+
+
+class YoutubeDLPoolTests(unittest.TestCase):
+    @mock.patch('deezload.base.YoutubeDL')
+    def test_lease(self, ydl_cls):
+        ydl_cls.side_effect = lambda options: mock.MagicMock(params=dict(options))
+        pool = YoutubeDLPool(max_idle=1)
+        options = get_ytdl_options('a')
+
+        with pool.lease(options) as (ydl, _):
+            pass
+        # reused for another output dir
+        with pool.lease(get_ytdl_options('b')) as (same, _):
+            self.assertIs(ydl, same)
+            self.assertEqual(os.path.join('b', '%(id)s.%(ext)s'), same.params['outtmpl'])
+            # leased instances are not shared
+            with pool.lease(options) as (other, _):
+                self.assertIsNot(ydl, other)
+        # but only max_idle of them are kept
+        ydl.__exit__.assert_called_once()
+        # other format requires another instance
+        with pool.lease(get_ytdl_options('a', format='flac')) as (flac, _):
+            self.assertIsNot(other, flac)
+        self.assertEqual(3, ydl_cls.call_count)
+
+        pool.close()
+        other.__exit__.assert_called_once()
+        flac.__exit__.assert_called_once()
+
+
+class FakeYoutubeDL(mock.MagicMock):
+    # durations of videos
+    durations = {}
+
+    def add_progress_hook(self, hook):
+        self.hook = hook
+
+    def extract_info(self, url, download=False):
+        video_id = parse_qs(urlparse(url).query)['v'][0]
+        return {'id': video_id, 'ext': 'webm', 'duration': self.durations.get(video_id)}
+
+    def process_info(self, info):
+        path = self.params['outtmpl'] % {'ext': info['ext']}
+        if info['id'] == 'bad':
+            open(path + '.part', 'w').close()
+            raise IOError('connection reset')
+        open(path, 'w').close()
+        self.hook({'status': 'finished', 'filename': path})
+
+
 class LoaderTests(unittest.TestCase):
     @unittest.skipIf(SKIP_SLOW, 'slow')
     def test_bad_input(self):
@@ -217,18 +366,27 @@ class LoaderTests(unittest.TestCase):
                 urls='',
                 output_dir='output',
                 limit=1,
+                cache=False,
+                library=False,
+                covers=False,
             )
         with self.assertRaises(AppException):
             Loader(
                 urls='fsd',
                 output_dir='output',
                 limit=1,
+                cache=False,
+                library=False,
+                covers=False,
             )
         with self.assertRaises(AppException):
             Loader(
                 urls='https://www.deezer.com/en/profile/1',
                 output_dir='output',
                 limit=1,
+                cache=False,
+                library=False,
+                covers=False,
             )
 
     @unittest.skipIf(SKIP_SLOW or SKIP_FFMPEG or SKIP_RISKY, 'slow and require ffmpeg')
@@ -238,7 +396,10 @@ class LoaderTests(unittest.TestCase):
             urls='https://www.deezer.com/en/profile/758196665',
             output_dir=output_dir,
             limit=1,
-            format='flac'
+            format='flac',
+            cache=False,
+            library=False,
+            covers=False,
         )
         last_status = None
         steps = 0
@@ -259,3 +420,164 @@ class LoaderTests(unittest.TestCase):
         self.assertEqual(1, len(tracks))
 
         shutil.rmtree(output_dir)
+
+    def test_staging(self):
+        output_dir = os.path.join(THIS_DIR, 'output')
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+
+        def convert(src, dst, format):
+            self.assertTrue(src.endswith('.webm'))
+            shutil.copy(os.path.join(THIS_DIR, 'a1.mp3'), dst)
+
+        tracks = [Track('artist', 'good', 'album'), Track('artist', 'bad', 'album')]
+        for track in tracks:
+            track.video_id = track.title
+            track.checked = True
+        loader = Loader(urls=[], output_dir=output_dir, slugify=False, cache=False,
+                        library=False, covers=False, playlists=[Playlist(None, tracks)])
+        statuses = {}
+        with mock.patch('deezload.base.YoutubeDL',
+                        side_effect=lambda options: FakeYoutubeDL(params=dict(options))), \
+                mock.patch('deezload.audio.convert', convert):
+            for status, track, i, prog in loader.load_gen():
+                statuses[track.title] = status
+
+        self.assertEqual(LoadStatus.FINISHED, statuses['good'])
+        self.assertEqual(LoadStatus.ERROR, statuses['bad'])
+        # only complete file is left, without staging dir and partial files
+        self.assertEqual(['artist - album - good.mp3'], os.listdir(output_dir))
+
+    @mock.patch('deezload.base.YoutubeDL',
+                side_effect=lambda options: FakeYoutubeDL(params=dict(options)))
+    @mock.patch('deezload.audio.convert',
+                lambda src, dst, format: shutil.copy(os.path.join(THIS_DIR, 'a1.mp3'), dst))
+    def test_shared_tracks(self, _):
+        output_dir = os.path.join(THIS_DIR, 'output')
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+
+        def playlist(name, ids):
+            tracks = [Track('artist', f'song {i}', 'album', deezer_id=i) for i in ids]
+            for track in tracks:
+                track.video_id, track.checked = f'v{track.deezer_id}', True
+            return Playlist(name, tracks)
+
+        loader = Loader(urls=[], output_dir=output_dir, slugify=False, cache=False,
+                        library=False, covers=False, jobs=2,
+                        playlists=[playlist('one', [1, 2, 3]), playlist('two', [3, 4, 1])])
+        with mock.patch.object(FakeYoutubeDL, 'process_info', autospec=True,
+                               side_effect=FakeYoutubeDL.process_info) as process_info:
+            events = [(i, status) for status, t, i, prog in loader.load_gen()
+                      if status in LoadStatus.finite_states()]
+
+        # index is global for all playlists
+        self.assertEqual(list(range(6)), sorted(i for i, _ in events))
+        self.assertEqual(LoadStatus.SKIPPED, dict(events)[3])
+        self.assertEqual(LoadStatus.SKIPPED, dict(events)[5])
+        self.assertEqual(2, loader.duplicates)
+        # every song is downloaded once
+        self.assertEqual(4, process_info.call_count)
+        with open(os.path.join(output_dir, 'two.m3u')) as f:
+            self.assertEqual(['artist - album - song 3.mp3', 'artist - album - song 4.mp3',
+                              'artist - album - song 1.mp3'], f.read().splitlines())
+
+    @mock.patch('deezload.base.YoutubeDL',
+                side_effect=lambda options: FakeYoutubeDL(params=dict(options)))
+    @mock.patch('deezload.audio.convert',
+                lambda src, dst, format: shutil.copy(os.path.join(THIS_DIR, 'a1.mp3'), dst))
+    @mock.patch('deezload.base.search_videos', return_value=['full_album', 'hours', 'song'])
+    @mock.patch.object(FakeYoutubeDL, 'durations',
+                       {'hours': 36000, 'full_album': 2400, 'song': 200})
+    def test_reject_video(self, search_videos, _):
+        output_dir = os.path.join(THIS_DIR, 'output')
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        cache = mock.Mock()
+        track = Track('artist', 'song', 'album', duration=210)
+        track.video_id, track.checked = 'full_album', True
+        other = Track('artist', 'other', 'album', duration=210)
+        other.video_id, other.checked = 'hours', True
+        loader = Loader(urls=[], output_dir=output_dir, slugify=False, cache=cache,
+                        library=False, covers=False, playlists=[Playlist(None, [track, other])])
+        statuses = {t.title: status for status, t, i, prog in loader.load_gen()}
+
+        self.assertEqual(LoadStatus.FINISHED, statuses['song'])
+        self.assertEqual('song', track.video_id)
+        cache.set.assert_any_call(track.search_key, 'song')
+        self.assertEqual(LoadStatus.FINISHED, statuses['other'])
+        self.assertEqual(2, search_videos.call_count)
+
+        search_videos.return_value = ['hours']
+        other.video_id, other.source = 'hours', None
+        other.alternatives = None
+        self.assertIsNone(loader.probe_video(YoutubeDLPool(), other))
+        self.assertIsNone(other.video_id)
+
+    def test_global_index(self):
+        output_dir = os.path.join(THIS_DIR, 'output')
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        playlists = [
+            Playlist(f'pl{p}', [Track('artist', f'{p}-{i}', 'album') for i in range(size)])
+            for p, size in enumerate([2, 3, 1])
+        ]
+
+        def load_tracks(ydl_pool, staging_dir, tasks, dedup):
+            for i, track in tasks:
+                track.path = os.path.join(output_dir, f'{track.title}.mp3')
+                yield LoadStatus.FINISHED, track, i, 1
+
+        loader = Loader(urls=[], output_dir=output_dir, cache=False, library=False,
+                        covers=False, playlists=playlists)
+        loader.load_tracks = load_tracks
+        events = [(i, track.title) for status, track, i, prog in loader.load_gen()]
+        # index keeps growing through the third playlist and later
+        self.assertEqual([(0, '0-0'), (1, '0-1'), (2, '1-0'), (3, '1-1'), (4, '1-2'),
+                          (5, '2-0')], events)
+
+    def test_lazy(self):
+        output_dir = os.path.join(THIS_DIR, 'output')
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        urls = ['https://www.deezer.com/en/playlist/1', 'https://www.deezer.com/en/playlist/2',
+                'https://www.deezer.com/en/playlist/3']
+
+        def get_playlist(url, index=0, limit=50, lazy=False):
+            self.assertTrue(lazy)
+            if url.endswith('2'):
+                raise AppException('not found')
+            # the first playlist turns out to be longer than reported
+            tracks = (Track('artist', f'{url[-1]}-{i}', 'album') for i in range(3))
+            if url.endswith('1'):
+                tracks = wait_resolved(tracks)
+            return Playlist(url[-1], tracks, 2 if url.endswith('1') else 4)
+
+        def wait_resolved(tracks):
+            # the third playlist is resolved in parallel while the first one loads
+            for _ in range(1000):
+                if len(loader) == 6:
+                    break
+                time.sleep(0.001)
+            yield from tracks
+
+        def load_tracks(ydl_pool, staging_dir, tasks, dedup):
+            for i, track in tasks:
+                if track is None:
+                    yield LoadStatus.ERROR, None, 0, 0
+                    continue
+                sizes.append(len(loader))
+                track.path = os.path.join(output_dir, f'{track.title}.mp3')
+                yield LoadStatus.FINISHED, track, i, 1
+
+        with mock.patch('deezload.base.get_playlist', side_effect=get_playlist) as get:
+            loader = Loader(urls=urls, output_dir=output_dir, cache=False,
+                            library=False, covers=False, lazy=True)
+            get.assert_not_called()
+            self.assertEqual(0, len(loader))
+            loader.load_tracks = load_tracks
+            sizes = []
+            events = [(status, track and track.title)
+                      for status, track, i, prog in loader.load_gen()]
+
+        # reported sizes of playlists count as soon as they are resolved
+        self.assertEqual([6, 6, 7, 7, 7, 7], sizes)
+        self.assertEqual(6, len(loader))
+        self.assertEqual(LoadStatus.ERROR, events[3][0])
+        self.assertEqual(['1-0', '1-1', '1-2', None, '3-0', '3-1', '3-2'], [t for _, t in events])
+        self.assertEqual(['1', '3'], [p.name for p in loader.playlists])
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from deezload.base import Track
+from deezload.cache import SearchCache
+
+
+class SearchCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'search.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get_set(self):
+        cache = SearchCache(self.path)
+        self.assertIsNone(cache.get('foo'))
+        cache.set('foo', 'id1')
+        self.assertEqual('id1', cache.get('foo'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+        # persisted
+        cache = SearchCache(self.path)
+        self.assertEqual('id1', cache.get('foo'))
+
+    def test_ttl(self):
+        cache = SearchCache(self.path, ttl=0.05)
+        cache.set('foo', 'id1')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('foo'))
+
+    def test_eviction(self):
+        cache = SearchCache(self.path, max_size=2)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.set('c', '3')
+        cache.get('a')
+        cache.prune()
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual('1', cache.get('a'))
+
+    def test_track_search_once(self):
+        cache = SearchCache(self.path)
+        track = Track(artist='The Beatles', title='Blackbird', album='The Beatles')
+        with mock.patch('deezload.base.get_video_id', return_value='vid') as get_video_id:
+            track.fetch_video_url(cache)
+            self.assertTrue(track.valid)
+            self.assertEqual(1, get_video_id.call_count)
+
+            track = Track(artist='the beatles', title='blackbird', album='The Beatles')
+            track.fetch_video_url(cache)
+            self.assertEqual('vid', track.video_id)
+            self.assertEqual(1, get_video_id.call_count)
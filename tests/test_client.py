@@ -0,0 +1,77 @@
+import io
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+from deezload import client
+from deezload.base import AppException, fetch_deezer
+
+
+def response(status=200, content=b'{}', headers=None):
+    res = requests.Response()
+    res.status_code = status
+    res.raw = io.BytesIO(content)
+    res.headers.update(headers or {})
+    return res
+
+
+class HostLimiterTests(unittest.TestCase):
+    def test_rate(self):
+        limiter = client.HostLimiter(rate=100, burst=1)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+            limiter.release()
+        self.assertGreaterEqual(time.monotonic() - start, 0.045)
+
+    def test_adaptive_concurrency(self):
+        limiter = client.HostLimiter(concurrency=8, window=2)
+        limiter.acquire()
+        limiter.release(throttled=True)
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(2, limiter.concurrency)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release()
+        self.assertEqual(4, limiter.concurrency)
+
+
+@mock.patch('deezload.client.time.sleep')
+@mock.patch('deezload.client.get_session')
+class GetTests(unittest.TestCase):
+    def test_retry(self, get_session, sleep):
+        get_session.return_value.get.side_effect = [
+            response(429, headers={'Retry-After': '3'}),
+            response(503),
+            requests.ConnectionError('reset'),
+            response(200, b'ok'),
+        ]
+        res = client.get('http://example.com/')
+        self.assertEqual(b'ok', res.content)
+        self.assertEqual(4, get_session.return_value.get.call_count)
+        self.assertEqual(3, sleep.call_args_list[0][0][0])
+
+    def test_give_up(self, get_session, sleep):
+        get_session.return_value.get.return_value = response(500)
+        self.assertEqual(500, client.get('http://example.com/', retries=2).status_code)
+        self.assertEqual(3, get_session.return_value.get.call_count)
+
+        get_session.return_value.get.side_effect = requests.ConnectionError('reset')
+        with self.assertRaises(requests.ConnectionError):
+            client.get('http://example.com/', retries=1)
+
+    def test_deezer_quota(self, get_session, sleep):
+        quota = b'{"error":{"type":"Exception","message":"Quota limit exceeded","code":4}}'
+        not_found = b'{"error":{"type":"DataException","message":"no data","code":800}}'
+        get_session.return_value.get.side_effect = [
+            response(200, quota),
+            response(200, b'{"title": "pl"}'),
+            response(200, not_found),
+        ]
+        self.assertEqual({'title': 'pl'}, fetch_deezer('http://api.deezer.com/playlist/1'))
+        with self.assertRaises(AppException):
+            fetch_deezer('http://api.deezer.com/playlist/2')
+        self.assertEqual(1, sleep.call_count)
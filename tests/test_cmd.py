@@ -0,0 +1,101 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from typing import Dict
+from unittest import mock
+
+from deezload.base import AppException, LoadStatus, Loader, Playlist, Track
+from deezload.cmd import batch
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# cumulative import time of cli entry point, slow hosts may raise it
+IMPORT_BUDGET_MS = int(os.environ.get('IMPORT_BUDGET_MS', '100'))
+HEAVY_MODULES = ('youtube_dl', 'sanic', 'tkinter', 'requests', 'mutagen')
+
+
+def import_times(module: str) -> Dict[str, float]:
+    """
+    Cumulative import time in ms of every module imported by `module`,
+    measured by `python -X importtime` in fresh interpreter.
+    """
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         cwd=ROOT_DIR, stderr=subprocess.PIPE, check=True)
+    times = {}
+    for line in res.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+class StartupTests(unittest.TestCase):
+    def test_cmd_imports(self):
+        times = import_times('deezload.cmd')
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, times)
+        self.assertLess(times['deezload.cmd'], IMPORT_BUDGET_MS)
+
+    def test_jobs_imports(self):
+        # listing and queueing of jobs doesn't load tracks
+        times = import_times('deezload.jobs')
+        self.assertNotIn('youtube_dl', times)
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_batch(self):
+        path = os.path.join(self.dir, 'urls.txt')
+        with open(path, 'w') as f:
+            f.write('# weekly\nhttps://www.deezer.com/en/playlist/1\n\n'
+                    'https://www.deezer.com/en/playlist/3\n'
+                    'https://www.deezer.com/en/playlist/2\n')
+
+        def get_playlist(url, index=0, limit=50, lazy=False):
+            if url.endswith('3'):
+                raise AppException('not found')
+            tracks = [Track('artist', f'{url[-1]}-{i}', 'album') for i in range(2)]
+            return Playlist(f'pl{url[-1]}', iter(tracks), 2, url)
+
+        def load_tracks(ydl_pool, staging_dir, tasks, dedup):
+            for i, track in tasks:
+                if track is None:
+                    yield LoadStatus.ERROR, None, i, 0
+                    continue
+                track.path = os.path.join(self.dir, f'{track.title}.mp3')
+                yield LoadStatus.FINISHED, track, i, 1
+
+        out = io.StringIO()
+        with mock.patch('deezload.base.get_playlist', side_effect=get_playlist), \
+                mock.patch.object(Loader, 'load_tracks', side_effect=load_tracks), \
+                redirect_stdout(out):
+            batch(path, {'output_dir': self.dir, 'cache': False, 'library': False,
+                         'covers': False})
+
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        # failed source is reported in place
+        failed = results.pop(2)
+        self.assertEqual('error', failed['status'])
+        self.assertEqual('https://www.deezer.com/en/playlist/3', failed['url'])
+        self.assertEqual('not found', failed['error'])
+        self.assertIsNone(failed['track'])
+        self.assertEqual([0, 1, 2, 3], [r['index'] for r in results])
+        self.assertEqual({'finished'}, {r['status'] for r in results})
+        self.assertEqual(['pl1', 'pl1', 'pl2', 'pl2'], [r['playlist'] for r in results])
+        self.assertEqual('https://www.deezer.com/en/playlist/2', results[-1]['url'])
+        self.assertEqual('2-1', results[-1]['track']['title'])
+        # m3u per source
+        with open(os.path.join(self.dir, 'pl2.m3u')) as f:
+            self.assertEqual(['2-0.mp3', '2-1.mp3'], f.read().splitlines())
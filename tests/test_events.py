@@ -0,0 +1,46 @@
+import json
+import unittest
+from unittest import mock
+
+from deezload.base import FailedSource, LoadStatus, Playlist, Track
+from deezload.events import LoadEvent, load_events
+
+
+class EventsTests(unittest.TestCase):
+    def test_load_events(self):
+        track = Track('artist', 'title', 'album')
+        other = Track('artist', 'other', 'album')
+        loader = mock.Mock(__len__=lambda _: 4)
+        loader.playlist_of.return_value = Playlist('pl', [], url='https://deezer.com/playlist/1')
+        loader.failed = FailedSource('https://deezer.com/playlist/2', 'not found')
+        raw = [
+            (LoadStatus.STARTING, track, 0, 0),
+            (LoadStatus.LOADING, track, 0, 0.5),
+            (LoadStatus.STARTING, other, 1, 0),
+            (LoadStatus.FINISHED, track, 0, 1),
+            (LoadStatus.ERROR, None, 0, 0),
+        ]
+        with mock.patch('time.monotonic', side_effect=[0, 1, 2, 3, 4, 5]):
+            events = list(load_events(loader, iter(raw), job_id=7))
+
+        self.assertEqual(['search', 'download', 'search', None, None], [e.stage for e in events])
+        self.assertEqual([0, 0.125, 0.125, 0.25, 0.25], [e.overall for e in events])
+        self.assertIsNone(events[0].eta)
+        # a quarter of the load took 4 seconds
+        self.assertEqual(12, events[3].eta)
+        self.assertEqual('loading: artist - title', events[0].message)
+        self.assertTrue(events[3].final)
+        self.assertIsNone(events[4].playlist)
+        self.assertEqual('https://deezer.com/playlist/2', events[4].url)
+        self.assertEqual("couldn't load https://deezer.com/playlist/2: not found",
+                         events[4].message)
+
+        track.timings = {'download': 1.5}
+        track.file_size = 1024
+        event = LoadEvent(LoadStatus.FINISHED, track, 3, 4, job_id=7)
+        data = json.loads(json.dumps(event.to_dict()))
+        self.assertEqual(7, data['job_id'])
+        self.assertEqual(3, data['index'])
+        self.assertEqual({'download': 1.5}, data['timings'])
+        self.assertEqual(1024, data['bytes'])
+        self.assertEqual('title', data['track']['title'])
@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from deezload.base import LoadStatus, Playlist, Track
+from deezload.jobs import JobStatus, JobStore, open_job, run_job
+
+
+class JobStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = JobStore(os.path.join(self.dir, 'jobs.sqlite3'), timeout=0.1)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_claim(self):
+        job = self.store.submit({'urls': ['foo']})
+        self.assertEqual(JobStatus.QUEUED, job.status)
+        running = self.store.submit({'urls': ['bar']}, JobStatus.RUNNING)
+
+        claimed = self.store.claim()
+        self.assertEqual(job.id, claimed.id)
+        self.assertEqual({'urls': ['foo']}, claimed.options)
+        self.assertEqual(JobStatus.RUNNING, self.store.get(job.id).status)
+        # running job isn't abandoned yet
+        self.assertIsNone(self.store.claim())
+
+        time.sleep(0.2)
+        self.assertEqual(job.id, self.store.claim().id)
+        self.assertEqual(running.id, self.store.claim().id)
+
+        self.store.set_status(job.id, JobStatus.FINISHED)
+        self.store.set_status(running.id, JobStatus.FINISHED)
+        time.sleep(0.2)
+        self.assertIsNone(self.store.claim())
+
+    def test_priority(self):
+        old = self.store.submit({'urls': ['old']})
+        urgent = self.store.submit({'urls': ['urgent']}, priority=1)
+        self.assertEqual(1, self.store.get(urgent.id).priority)
+        self.assertEqual(urgent.id, self.store.claim().id)
+        self.assertEqual(old.id, self.store.claim().id)
+
+    def test_delete(self):
+        job = self.store.submit({'urls': ['foo']})
+        kept = self.store.submit({'urls': ['bar']})
+        for job_id in (job.id, kept.id):
+            self.store.set_playlists(job_id, [Playlist('pl', [Track('a', 't', 'b')])])
+
+        self.store.delete(job.id)
+        self.assertIsNone(self.store.get(job.id))
+        self.assertIsNone(self.store.get_playlists(job.id))
+        self.assertEqual({}, self.store.track_statuses(job.id))
+        self.assertEqual({'pending': 1}, self.store.track_statuses(kept.id))
+
+    def test_resume(self):
+        tracks = [
+            Track(artist='a', title=f't{i}', album='b')
+            for i in range(3)
+        ]
+        output_dir = os.path.join(self.dir, 'output')
+        job = self.store.submit({'urls': ['foo'], 'output_dir': output_dir, 'cache': False,
+                                 'library': False, 'covers': False}, JobStatus.RUNNING)
+        self.store.set_playlists(job.id, [Playlist('pl', tracks)])
+        loader = open_job(self.store, job)
+        self.assertEqual(3, len(loader))
+
+        def load_gen():
+            # tracks are read from the store lazily
+            playlist = loader.on_playlist(0, loader.playlists[0])
+            tracks = iter(playlist.tracks)
+            track = next(tracks)
+            track.video_id = 'vid'
+            track.checked = True
+            yield LoadStatus.LOADING, track, 0, 0.2
+            yield LoadStatus.FINISHED, track, 0, 1
+            track = next(tracks)
+            track.checked = True
+            yield LoadStatus.FAILED, track, 1, 1
+            yield LoadStatus.STARTING, next(tracks), 2, 0
+
+        loader.load_gen = load_gen
+        events = run_job(self.store, job, loader)
+        for _ in range(3):
+            next(events)
+        events.close()
+        # interrupted job is continued by worker
+        self.assertEqual(JobStatus.QUEUED, self.store.get(job.id).status)
+        self.assertEqual(job.id, self.store.claim().id)
+        self.assertEqual({'finished': 1, 'failed': 1, 'pending': 1},
+                         self.store.track_statuses(job.id))
+
+        playlists = self.store.get_playlists(job.id)
+        self.assertEqual('pl', playlists[0].name)
+        first, second, third = playlists[0].tracks
+        self.assertEqual(('vid', True), (first.video_id, first.checked))
+        self.assertEqual((None, True), (second.video_id, second.checked))
+        self.assertEqual((None, False), (third.video_id, third.checked))
+        self.assertEqual('t2', third.title)
+
+    def test_stop(self):
+        job = self.store.submit({'urls': ['foo'], 'cache': False, 'library': False,
+                                 'covers': False, 'output_dir': self.dir}, JobStatus.RUNNING)
+        self.store.set_playlists(job.id, [Playlist('pl', [Track('a', 't', 'b')])])
+        loader = open_job(self.store, job)
+        loader.load_gen = lambda: iter([(LoadStatus.STARTING, None, 0, 0)] * 2)
+        stopped = threading.Event()
+        events = run_job(self.store, job, loader, stopped=stopped)
+        next(events)
+        stopped.set()
+        events.close()
+        # stopped by user, worker doesn't take it
+        self.assertEqual(JobStatus.STOPPED, self.store.get(job.id).status)
+        self.assertIsNone(self.store.claim())
+
+    def test_lazy_playlists(self):
+        job = self.store.submit({'urls': ['foo']})
+        tracks = (Track(artist='a', title=f't{i}', album='b') for i in range(7))
+        self.store.set_playlists(job.id, [Playlist('pl', tracks, 7)], batch_size=3)
+
+        playlists = self.store.get_playlists(job.id, lazy=True)
+        self.assertEqual(7, playlists[0].length)
+        tracks = playlists[0].tracks
+        self.assertNotIsInstance(tracks, list)
+        self.assertEqual([f't{i}' for i in range(7)], [t.title for t in tracks])
+
+    def test_resolve_while_loading(self):
+        output_dir = os.path.join(self.dir, 'output')
+        job = self.store.submit({'urls': 'https://www.deezer.com/en/playlist/1',
+                                 'output_dir': output_dir, 'cache': False, 'library': False,
+                                 'covers': False}, JobStatus.RUNNING)
+        tracks = (Track(artist='a', title=f't{i}', album='b') for i in range(5))
+        with mock.patch('deezload.base.get_playlist', return_value=Playlist('pl', tracks, 4)):
+            loader = open_job(self.store, job)
+            self.assertIsNone(self.store.get_playlists(job.id))
+
+            def load_tracks(ydl_pool, staging_dir, tasks, dedup):
+                for i, track in tasks:
+                    # track is saved before it's loaded
+                    self.assertEqual(i + 1, sum(self.store.track_statuses(job.id).values()))
+                    track.path = os.path.join(output_dir, f'{track.title}.mp3')
+                    yield LoadStatus.FINISHED, track, i, 1
+
+            loader.load_tracks = load_tracks
+            for _ in run_job(self.store, job, loader, batch_size=1):
+                pass
+
+        self.assertEqual(5, len(loader))
+        self.assertEqual(JobStatus.FINISHED, self.store.get(job.id).status)
+        self.assertEqual({'finished': 5}, self.store.track_statuses(job.id))
+        playlists = self.store.get_playlists(job.id)
+        self.assertEqual('pl', playlists[0].name)
+        self.assertEqual([f't{i}' for i in range(5)], [t.title for t in playlists[0].tracks])
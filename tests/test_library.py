@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mutagen
+
+from deezload.base import Loader, Playlist, Track
+from deezload.library import Library
+
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class LibraryTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.music_dir = os.path.join(self.dir, 'music')
+        os.makedirs(os.path.join(self.music_dir, 'foo'))
+        self.library = Library(os.path.join(self.dir, 'library.sqlite3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def add_file(self, name: str, artist='Foo', album='Bar', title='Baz') -> str:
+        ext = os.path.splitext(name)[1]
+        path = os.path.join(self.music_dir, name)
+        shutil.copy(os.path.join(THIS_DIR, f'a1{ext}'), path)
+        audio = mutagen.File(path, easy=True)
+        audio['artist'] = artist
+        audio['album'] = album
+        audio['title'] = title
+        audio.save()
+        return path
+
+    def test_reindex(self):
+        mp3 = self.add_file('foo/baz.mp3')
+        flac = self.add_file('baz.flac', title='Baz!')
+        self.assertEqual(2, self.library.reindex(self.music_dir))
+        # nothing changed
+        self.assertEqual(0, self.library.reindex(self.music_dir))
+
+        entries = self.library.find('foo', 'bar', 'baz')
+        self.assertEqual({(mp3, 'mp3'), (flac, 'flac')},
+                         {(e.path, e.format) for e in entries})
+
+        os.remove(mp3)
+        self.library.reindex(self.music_dir)
+        self.assertEqual([flac], [e.path for e in self.library.find('Foo', 'Bar', 'Baz')])
+
+    def test_find_by_video_id(self):
+        mp3 = self.add_file('baz.mp3')
+        self.library.add(mp3, 'Foo', 'Bar', 'Baz', video_id='vid')
+        entries = self.library.find('Other', 'Name', 'Baz', video_id='vid')
+        self.assertEqual([mp3], [e.path for e in entries])
+
+    def test_loader_links_file(self):
+        mp3 = self.add_file('baz.mp3')
+        self.library.reindex(self.music_dir)
+        output_dir = os.path.join(self.dir, 'output')
+        loader = Loader(
+            urls=[],
+            output_dir=output_dir,
+            tree=True,
+            slugify=False,
+            cache=False,
+            library=self.library,
+            covers=False,
+            playlists=[Playlist(None, [Track(artist='Foo', title='Baz', album='Bar')])],
+        )
+        events = [str(status) for status, track, i, prog in loader.load_gen()]
+        self.assertEqual(['starting', 'skipped'], events)
+        linked = os.path.join(output_dir, 'Foo', 'Bar', 'Baz.mp3')
+        self.assertTrue(os.path.exists(linked))
+        self.assertEqual(os.stat(mp3).st_ino, os.stat(linked).st_ino)
+        self.assertIn(linked, self.library)
+
+    def test_loader_converts_file(self):
+        self.add_file('baz.mp3')
+        self.library.reindex(self.music_dir)
+        loader = Loader(urls=[], output_dir=os.path.join(self.dir, 'output'),
+                        format='flac', cache=False, library=self.library, covers=False,
+                        playlists=[])
+        track = Track(artist='Foo', title='Baz', album='Bar')
+        track.set_output_path(loader.output_dir, loader.format)
+        self.assertFalse(loader.check_library(track))
+        self.assertEqual(os.path.join(self.music_dir, 'baz.mp3'), track.source)
+
+    def test_loader_drops_stale_entry(self):
+        mp3 = self.add_file('baz.mp3')
+        self.library.reindex(self.music_dir)
+        loader = Loader(urls=[], output_dir=self.music_dir, slugify=False, cache=False,
+                        library=self.library, covers=False, playlists=[])
+        track = Track(artist='Foo', title='Baz', album='Bar')
+        track.path = mp3
+        self.assertTrue(loader.check_library(track))
+
+        # deleted outside of deezload, so it's loaded again
+        os.remove(mp3)
+        self.assertFalse(loader.check_library(track))
+        self.assertNotIn(mp3, self.library)
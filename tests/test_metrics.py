@@ -0,0 +1,40 @@
+import unittest
+
+from deezload.base import LoadStatus, Track
+from deezload.metrics import Histogram, Metrics
+
+
+class MetricsTests(unittest.TestCase):
+    def test_histogram(self):
+        hist = Histogram(buckets=(1, 5))
+        for value in (0.5, 2, 10):
+            hist.observe(value)
+        self.assertEqual([1, 2], hist.counts)
+        self.assertEqual(3, hist.count)
+        self.assertEqual(12.5, hist.sum)
+        self.assertEqual(10, hist.max)
+
+    def test_observe(self):
+        metrics = Metrics()
+        track = Track('artist', 'title', 'album')
+        track.timings = {'search': 0.2, 'download': 3.0}
+        track.file_size = 1024
+
+        metrics.observe(LoadStatus.LOADING, track)
+        self.assertEqual({}, metrics.stages)
+
+        metrics.observe(LoadStatus.FINISHED, track)
+        metrics.observe(LoadStatus.SKIPPED, Track('a', 't', 'al'))
+        self.assertEqual(1, metrics.tracks['finished'])
+        self.assertEqual(1, metrics.tracks['skipped'])
+        self.assertEqual(1024, metrics.bytes)
+        self.assertEqual(
+            [('search', 1, 0.2, 0.2), ('download', 1, 3.0, 3.0)],
+            metrics.summary()
+        )
+
+        text = metrics.render()
+        self.assertIn('deezload_tracks_total{status="finished"} 1', text)
+        self.assertIn('deezload_downloaded_bytes_total 1024', text)
+        self.assertIn('deezload_stage_duration_seconds_bucket{stage="download",le="5"} 1', text)
+        self.assertIn('deezload_stage_duration_seconds_count{stage="search"} 1', text)
@@ -0,0 +1,94 @@
+import threading
+import time
+import unittest
+
+from deezload.pipeline import Pipeline, Stage
+
+
+class PipelineTests(unittest.TestCase):
+    def test_events_order_per_item(self):
+        def first(item, emit):
+            emit('first', item)
+            return item % 3 != 0
+
+        def second(item, emit):
+            time.sleep(0.001 * (item % 4))
+            emit('second', item)
+            return True
+
+        pipeline = Pipeline([
+            Stage('first', first, 3),
+            Stage('second', second, 3),
+        ], maxsize=2)
+        events = list(pipeline.run(range(20)))
+
+        for item in range(20):
+            item_events = [name for name, i in events if i == item]
+            if item % 3 == 0:
+                self.assertEqual(['first'], item_events)
+            else:
+                self.assertEqual(['first', 'second'], item_events)
+
+    def test_concurrency(self):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def work(item, emit):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+            emit(item)
+            return True
+
+        pipeline = Pipeline([Stage('work', work, 4)])
+        events = list(pipeline.run(range(12)))
+        self.assertEqual(12, len(events))
+        self.assertTrue(active[1] > 1)
+
+    def test_errors(self):
+        errors = []
+
+        def fail(item, emit):
+            if item == 1:
+                raise ValueError(item)
+            emit(item)
+            return True
+
+        pipeline = Pipeline([Stage('fail', fail)],
+                            on_error=lambda item, e: errors.append(item))
+        events = list(pipeline.run(range(3)))
+        self.assertEqual([(0,), (2,)], events)
+        self.assertEqual([1], errors)
+
+    def test_stop(self):
+        def work(item, emit):
+            emit(item)
+            return True
+
+        pipeline = Pipeline([Stage('work', work, 2)], maxsize=1)
+        gen = pipeline.run(range(1000))
+        next(gen)
+        gen.close()
+        self.assertTrue(pipeline.stopped.is_set())
+
+    def test_stop_drops_items_between_stages(self):
+        started = []
+
+        def first(item, emit):
+            emit(item)
+            # still working on it when the load is stopped
+            pipeline.stopped.wait()
+            return True
+
+        def second(item, emit):
+            started.append(item)
+            return True
+
+        pipeline = Pipeline([Stage('first', first), Stage('second', second)], maxsize=1)
+        gen = pipeline.run(range(10))
+        self.assertEqual((0,), next(gen))
+        gen.close()
+        self.assertEqual([], started)
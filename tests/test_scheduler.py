@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+
+from deezload.scheduler import Scheduler, Session
+
+
+class SchedulerTests(unittest.TestCase):
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'timed out')
+            time.sleep(0.001)
+
+    def run_waiting(self, scheduler: Scheduler, holder: Session, sessions: list) -> list:
+        """
+        Queue one worker per session while `holder` takes the only slot,
+        release it and return sessions in order they got the slot.
+        """
+        order = []
+        scheduler.acquire(holder, 'download')
+
+        def work(session: Session):
+            with session.slot('download'):
+                order.append(session.user)
+
+        threads = []
+        for session in sessions:
+            thread = threading.Thread(target=work, args=(session,))
+            thread.start()
+            threads.append(thread)
+            # queue in given order
+            self.wait_for(lambda: session.waiting['download'] == sum(
+                s is session for s in sessions[:len(threads)]))
+        scheduler.release(holder, 'download')
+        for thread in threads:
+            thread.join()
+        return order
+
+    def test_round_robin(self):
+        scheduler = Scheduler({'download': 1})
+        big, small = scheduler.session('big'), scheduler.session('small')
+        order = self.run_waiting(scheduler, scheduler.session('holder'),
+                                 [big, big, big, small])
+        # single track of small load isn't queued after all tracks of big one
+        self.assertEqual(['big', 'small', 'big', 'big'], order)
+        self.assertEqual([], scheduler.sessions)
+        self.assertEqual({'download': 1}, scheduler.free)
+
+    def test_weight_and_priority(self):
+        scheduler = Scheduler({'download': 1})
+        heavy = scheduler.session('heavy', weight=2)
+        light = scheduler.session('light')
+        order = self.run_waiting(scheduler, scheduler.session('holder'),
+                                 [light, light, light, heavy, heavy, heavy])
+        self.assertEqual(['light', 'heavy', 'heavy', 'light', 'heavy', 'light'], order)
+
+        urgent = scheduler.session('urgent', priority=1)
+        order = self.run_waiting(scheduler, scheduler.session('holder'), [light, urgent])
+        self.assertEqual(['urgent', 'light'], order)
+
+    def test_user_cap(self):
+        scheduler = Scheduler({'download': 3}, user_cap=1)
+        first, second = scheduler.session('user'), scheduler.session('user')
+        other = scheduler.session('other')
+        scheduler.acquire(first, 'download')
+
+        acquired = threading.Event()
+
+        def work():
+            with second.slot('download'):
+                acquired.set()
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        self.wait_for(lambda: second.waiting['download'] == 1)
+        # budget isn't exhausted, but user is at its cap
+        with other.slot('download'):
+            self.assertFalse(acquired.is_set())
+        scheduler.release(first, 'download')
+        thread.join()
+        self.assertTrue(acquired.is_set())
+
+    def test_unknown_budget(self):
+        scheduler = Scheduler({'download': 1})
+        session = scheduler.session('user')
+        with session.slot('transcode'), session.slot('transcode'):
+            self.assertEqual([], scheduler.sessions)
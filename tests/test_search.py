@@ -0,0 +1,105 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+import requests
+
+from deezload.base import get_video_id
+from deezload.search import ResultsParser, SearchResult, check_video, parse_duration, rank
+
+
+def renderer(video_id: str, title: str, length: str) -> str:
+    return json.dumps({'videoRenderer': {
+        'videoId': video_id,
+        'thumbnail': {'thumbnails': [{'url': f'https://i.ytimg.com/vi/{video_id}/0.jpg'}]},
+        'title': {'runs': [{'text': title}]},
+        'lengthText': {'accessibility': {}, 'simpleText': length},
+        'navigationEndpoint': {'url': f'/watch?v={video_id}'},
+    }}, separators=(',', ':'))[1:-1].replace('&', '\\u0026')
+
+
+PAGE = (
+    '<html><script>var ytInitialData = {"contents":[{' + ','.join([
+        renderer('live0000000', 'Artist - Song (Live at Wembley)', '5:10'),
+        renderer('cover000000', 'Song - cover by someone', '3:31'),
+        renderer('official000', 'Artist - Song & more (Official Audio)', '3:29'),
+        renderer('long0000000', 'Artist - Song', '1:03:29'),
+    ]) + '}]};</script>' + '<div></div>' * 1000 + '</html>'
+).encode()
+
+
+def parse(page: bytes, chunk_size: int, limit=5) -> ResultsParser:
+    parser = ResultsParser(limit)
+    for i in range(0, len(page), chunk_size):
+        parser.feed(page[i:i + chunk_size])
+        if parser.done:
+            return parser
+    parser.feed(b'', final=True)
+    return parser
+
+
+class SearchTests(unittest.TestCase):
+    def test_parse_duration(self):
+        self.assertEqual(209, parse_duration('3:29'))
+        self.assertEqual(3809, parse_duration('1:03:29'))
+
+    def test_parser(self):
+        expected = [
+            SearchResult('live0000000', 'Artist - Song (Live at Wembley)', 310),
+            SearchResult('cover000000', 'Song - cover by someone', 211),
+            SearchResult('official000', 'Artist - Song & more (Official Audio)', 209),
+            SearchResult('long0000000', 'Artist - Song', 3809),
+        ]
+        for chunk_size in (1, 7, 100, len(PAGE)):
+            self.assertEqual(expected, parse(PAGE, chunk_size).candidates(), chunk_size)
+
+    def test_stop_early(self):
+        parser = parse(PAGE, 100, limit=2)
+        self.assertTrue(parser.done)
+        self.assertEqual(['live0000000', 'cover000000'],
+                         [r.video_id for r in parser.candidates()])
+
+    def test_escaped_page(self):
+        # mobile page keeps its data in js string
+        page = PAGE.decode().replace('"', '\\x22').replace('{', '\\x7b').encode()
+        for chunk_size in (1, 5, len(page)):
+            parser = parse(page, chunk_size)
+            self.assertEqual('official000', parser.candidates()[2].video_id)
+            self.assertEqual(209, parser.candidates()[2].duration)
+
+    def test_links(self):
+        page = b'<a href="/watch?v=first000000">x</a><a href="/watch?v=second00000&amp;t=1">'
+        for chunk_size in (1, len(page)):
+            self.assertEqual(['first000000', 'second00000'],
+                             [r.video_id for r in parse(page, chunk_size).candidates()])
+
+    def test_rank(self):
+        candidates = parse(PAGE, len(PAGE)).candidates()
+        self.assertEqual(['official000', 'live0000000', 'long0000000', 'cover000000'],
+                         [r.video_id for r in rank(candidates, 'Artist - Song', 210)])
+        # versions requested by track itself aren't penalised
+        self.assertEqual('live0000000',
+                         rank(candidates, 'Artist - Song (Live at Wembley)')[0].video_id)
+        self.assertEqual([], rank([], 'Artist - Song'))
+
+    def test_check_video(self):
+        self.assertIsNone(check_video({'duration': 200, 'filesize': 4 * 1024 * 1024}, 210))
+        self.assertIsNone(check_video({}, 210))
+        self.assertIsNotNone(check_video(None, 210))
+        self.assertIn('duration', check_video({'duration': 36000}, 210))
+        self.assertIn('size', check_video({'filesize_approx': 500 * 1024 * 1024}))
+
+    @mock.patch('deezload.base.client.get')
+    def test_get_video_id(self, get):
+        res = requests.Response()
+        res.status_code = 200
+        res.raw = io.BytesIO(PAGE)
+        get.return_value = res
+        self.assertEqual('official000', get_video_id('Artist - Song', 209))
+
+        res = requests.Response()
+        res.status_code = 200
+        res.raw = io.BytesIO(b'<html>nothing</html>')
+        get.return_value = res
+        self.assertIsNone(get_video_id('Artist - Song', 209))
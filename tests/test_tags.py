@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import mutagen
+
+from deezload import tags
+from deezload.base import Track
+
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+COVER = b'\xff\xd8\xff\xe0fake jpeg'
+
+
+class TagsTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def restore(self, ext: str) -> str:
+        path = os.path.join(self.dir, f'a1.{ext}')
+        shutil.copy(os.path.join(THIS_DIR, f'a1.{ext}'), path)
+        track = Track('artist', 'title', 'album', track_number=3, disc_number=1,
+                      year='1968', isrc='GBAYE0601690')
+        track.path = path
+        track.restore_meta(COVER)
+        return path
+
+    def test_mp3(self):
+        path = self.restore('mp3')
+        audio = mutagen.File(path, easy=True)
+        self.assertEqual(['artist'], audio['artist'])
+        self.assertEqual(['3'], audio['tracknumber'])
+        self.assertEqual(['1968'], audio['date'])
+        self.assertEqual(['GBAYE0601690'], audio['isrc'])
+        self.assertEqual(COVER, mutagen.File(path).tags.getall('APIC')[0].data)
+
+    def test_flac(self):
+        path = self.restore('flac')
+        audio = mutagen.File(path)
+        self.assertEqual(['title'], audio['title'])
+        self.assertEqual(['1'], audio['discnumber'])
+        self.assertEqual(['GBAYE0601690'], audio['isrc'])
+        self.assertEqual(COVER, audio.pictures[0].data)
+
+    def test_cover_cache(self):
+        cache = tags.CoverCache(self.dir)
+        res = mock.Mock(content=COVER)
+        with mock.patch('deezload.client.get', return_value=res) as get:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                covers = list(executor.map(cache.get, ['http://cover'] * 8))
+            self.assertEqual([COVER] * 8, covers)
+            self.assertEqual(1, get.call_count)
+            self.assertIsNone(cache.get(None))